@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import sys
+import time
+
+from importers.dispatch import probe_date_range
+
+
+def first_date(importer, source):
+    """
+    The date an imported file is archived under: the earliest date of its
+    entries, as read by the first importer that identifies it. None if it has
+    no dated entries or they can't be read.
+    """
+    try:
+        date_range = probe_date_range(importer, source)
+    except Exception as e:
+        print(f"  Warning: Importer matched but failed to read dates: {e}", file=sys.stderr)
+        return None
+    return date_range[0] if date_range else None
+
+
+def destination(archive_dir, filepath, first):
+    """archive/YYYY/YYYY-MM-DD_<name> for a file whose entries start on first."""
+    return os.path.join(archive_dir, str(first.year), f"{first:%Y-%m-%d}_{os.path.basename(filepath)}")
+
+
+def move_to_archive(filepath, dest_path):
+    """
+    Move filepath to dest_path, creating its directory. If something is
+    already there, a timestamp is added to the name. Returns where it went.
+    """
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    if os.path.exists(dest_path):
+        print(f"  Warning: Destination {dest_path} exists. Appending timestamp.", file=sys.stderr)
+        dirname, filename = os.path.split(dest_path)
+        date_str, name = filename.split("_", 1)
+        dest_path = os.path.join(dirname, f"{date_str}_{int(time.time())}_{name}")
+    print(f"  Archiving to {dest_path}", file=sys.stderr)
+    shutil.move(filepath, dest_path)
+    return dest_path
+
+
+def _signature(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class ArchivePlan:
+    """
+    Where each file ingest imported goes in the archive, worked out while it
+    was extracted, so accepting can archive the files without identifying or
+    reading them again. A file is only moved if its size and modification
+    time are still what they were when it was imported.
+    """
+
+    def __init__(self, path, files=None):
+        self.path = path
+        # filepath -> {"destination": ..., "signature": [size, mtime]}
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                return cls(path, json.load(f)["files"])
+        except (OSError, ValueError, KeyError):
+            return cls(path)
+
+    def add(self, filepath, archive_dir, first):
+        if first is None:
+            self.files.pop(filepath, None)
+            return
+        self.files[filepath] = {
+            "destination": destination(archive_dir, filepath, first),
+            "signature": _signature(filepath),
+        }
+
+    def save(self):
+        if not self.files:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"files": self.files}, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def execute(self):
+        """
+        Move the planned files to the archive and forget them. Files that were
+        changed or removed since they were imported are left where they are.
+        Returns the number of files moved.
+        """
+        moved = 0
+        for filepath, planned in sorted(self.files.items()):
+            if not os.path.exists(filepath):
+                print(f"  {filepath} is gone, nothing to archive", file=sys.stderr)
+            elif _signature(filepath) != planned["signature"]:
+                print(
+                    f"  Warning: {filepath} changed since it was imported. "
+                    "Skipping, import it again or run `mise run archive`.",
+                    file=sys.stderr,
+                )
+                continue
+            else:
+                print(f"Processing {os.path.basename(filepath)}...", file=sys.stderr)
+                move_to_archive(filepath, planned["destination"])
+                moved += 1
+            del self.files[filepath]
+        self.save()
+        return moved
@@ -1,5 +1,8 @@
 import os
+import re
 import sys
+from collections import deque, namedtuple
+
 import yaml
 import config_utils
 
@@ -8,6 +11,206 @@ RULES_FILE = config_utils.get_rules_file()
 
 CATEGORY_RULES = {}
 
+# A categorization rule; index is its position in user_rules.yaml
+Rule = namedtuple("Rule", ["index", "pattern", "account"])
+
+# Patterns using numbered backreferences or conditionals can't be renumbered
+# into a combined expression.
+_UNCOMBINABLE_RE = re.compile(r"\\[1-9]|\(\?\(")
+
+_REGEX_SPECIAL = set(".^$*+?{}[]()|\\")
+
+
+def _literal_alternatives(pattern):
+    """
+    Split a pattern like "Woolworths|Coles" into its lowercased literals.
+    Returns None if the pattern uses any regex syntax beyond "|" and escaped
+    punctuation, or anything outside printable ASCII (where lower() and
+    re.IGNORECASE could disagree).
+    """
+    alternatives = []
+    current = []
+    chars = iter(pattern)
+    for char in chars:
+        if char == "\\":
+            char = next(chars, "")
+            if not (char.isascii() and char.isprintable()) or char.isalnum():
+                return None
+        elif char == "|":
+            alternatives.append("".join(current))
+            current = []
+            continue
+        elif char in _REGEX_SPECIAL or not (char.isascii() and char.isprintable()):
+            return None
+        current.append(char.lower())
+    alternatives.append("".join(current))
+
+    # An empty alternative matches everything; leave that to the regex engine
+    if not all(alternatives):
+        return None
+    return alternatives
+
+
+def _compile_matcher(rules):
+    """
+    Compile rules into a function returning the first Rule that matches a
+    description (or None).
+
+    Every pattern is wrapped in a lookahead with its own named group and the
+    lookaheads are tried in rule order at the start of the description, so the
+    first rule that would match with re.search wins.
+    """
+    if not rules:
+        return lambda description: None
+
+    if not any(_UNCOMBINABLE_RE.search(rule.pattern) for rule in rules):
+        # [\s\S] rather than DOTALL, which would change what "." means in the rules
+        combined = "|".join(
+            rf"(?=[\s\S]*?(?:{rule.pattern}))(?P<r{rule.index}>)" for rule in rules
+        )
+        try:
+            match = re.compile(combined, re.IGNORECASE).match
+        except re.error:
+            # e.g. the same group name used in two rules
+            pass
+        else:
+            by_group = {f"r{rule.index}": rule for rule in rules}
+
+            def first_match(description):
+                found = match(description)
+                return by_group[found.lastgroup] if found else None
+
+            return first_match
+
+    searches = [(re.compile(rule.pattern, re.IGNORECASE).search, rule) for rule in rules]
+
+    def first_match(description):
+        for search, rule in searches:
+            if search(description):
+                return rule
+        return None
+
+    return first_match
+
+
+class LiteralMatcher:
+    """
+    An Aho-Corasick automaton over lowercased literals, each tagged with the
+    index of the rule it came from. One scan of a description finds every
+    literal it contains.
+    """
+
+    def __init__(self, literals):
+        self.goto = [{}]
+        self.fail = [0]
+        # Lowest rule index of any literal ending at each node, following fail links
+        self.lowest = [None]
+
+        for literal, index in literals:
+            node = 0
+            for char in literal:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.lowest.append(None)
+                    self.goto[node][char] = child
+                node = child
+            self.lowest[node] = _lowest(self.lowest[node], index)
+
+        # Breadth-first, so a node's fail target is always finished before the node
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.lowest[child] = _lowest(self.lowest[child], self.lowest[self.fail[child]])
+
+    def lowest_index(self, text):
+        """Return the lowest rule index among all literals found in text, or None."""
+        goto, fail, lowest = self.goto, self.fail, self.lowest
+        node = 0
+        best = None
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            found = lowest[node]
+            if found is not None and (best is None or found < best):
+                best = found
+        return best
+
+
+def _lowest(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+class RuleEngine:
+    """
+    Matches descriptions against all categorization rules at once.
+
+    Rules that are plain alternations of literals (most merchant rules) go into
+    a LiteralMatcher; the rest are compiled into a single regex. The first rule
+    in the YAML that would match with re.search wins, as before.
+    """
+
+    def __init__(self, rules=None):
+        self.set_rules(rules or {})
+
+    def set_rules(self, rules):
+        self.rules = []
+        for pattern, account in rules.items():
+            try:
+                re.compile(pattern, re.IGNORECASE)
+            except re.error as e:
+                print(f"Ignoring invalid rule pattern {pattern!r}: {e}", file=sys.stderr)
+                continue
+            self.rules.append(Rule(len(self.rules), pattern, account))
+
+        literals = []
+        regex_rules = []
+        for rule in self.rules:
+            alternatives = _literal_alternatives(rule.pattern)
+            if alternatives is None:
+                regex_rules.append(rule)
+            else:
+                literals.extend((literal, rule.index) for literal in alternatives)
+
+        # Descriptions that aren't plain ASCII go through the regex for every rule
+        self._match_all = _compile_matcher(self.rules)
+        self._match_regex = _compile_matcher(regex_rules)
+        self._first_regex_index = regex_rules[0].index if regex_rules else len(self.rules)
+        self._literals = LiteralMatcher(literals) if literals else None
+
+    def match(self, description):
+        """Return the first Rule matching description, or None."""
+        if self._literals is None or not description.isascii():
+            return self._match_all(description)
+
+        best = self._literals.lowest_index(description.lower())
+        if best is not None and best < self._first_regex_index:
+            return self.rules[best]
+
+        # A regex rule only wins if it comes before the best literal rule
+        rule = self._match_regex(description)
+        if rule is not None and (best is None or rule.index < best):
+            return rule
+        return self.rules[best] if best is not None else None
+
+
+# Shared by all importers
+RULE_ENGINE = RuleEngine()
+
+
 def load_rules():
     global CATEGORY_RULES
     if not os.path.exists(RULES_FILE):
@@ -27,5 +230,7 @@ def load_rules():
     except Exception as e:
         print(f"Error loading categorization rules from {RULES_FILE}: {e}", file=sys.stderr)
 
+    RULE_ENGINE.set_rules(CATEGORY_RULES)
+
 # Load rules on import
 load_rules()
@@ -35,3 +35,31 @@ def get_archive_dir():
 
 def get_staging_file():
     return get_env_path("BEANCOUNT_STAGING_FILE", "staging/import.bean")
+
+def get_cache_dir(ledger_dir=None):
+    """Generated state that can always be rebuilt, kept out of the ledger directory."""
+    default = os.path.join(os.path.dirname(os.path.abspath(ledger_dir or get_ledger_dir())), ".cache")
+    return get_env_path("BEANCOUNT_CACHE_DIR", default)
+
+def get_fingerprint_file(ledger_dir=None):
+    default = os.path.join(get_cache_dir(ledger_dir), "fingerprints.sqlite")
+    return get_env_path("BEANCOUNT_FINGERPRINT_FILE", default)
+
+def get_ingest_cache_dir(staging_file=None):
+    default = os.path.join(os.path.dirname(staging_file or get_staging_file()), ".ingest-cache")
+    return get_env_path("BEANCOUNT_INGEST_CACHE_DIR", default)
+
+def get_archive_plan_file(staging_file=None):
+    default = os.path.join(os.path.dirname(staging_file or get_staging_file()), "archive-plan.json")
+    return get_env_path("BEANCOUNT_ARCHIVE_PLAN_FILE", default)
+
+def get_check_cache_dir(ledger_dir=None):
+    default = os.path.join(get_cache_dir(ledger_dir), "check")
+    return get_env_path("BEANCOUNT_CHECK_CACHE_DIR", default)
+
+def get_recent_file():
+    return get_env_path("BEANCOUNT_RECENT_FILE", "recent.bean")
+
+def get_snapshot_file(ledger_dir=None):
+    default = os.path.join(get_cache_dir(ledger_dir), "snapshot.bean")
+    return get_env_path("BEANCOUNT_SNAPSHOT_FILE", default)
@@ -0,0 +1,192 @@
+import bisect
+import re
+
+from beancount.core import data, flags
+
+from fingerprints import posting_keys
+
+
+class DedupIndex:
+    """A hash index over existing transactions for constant-time duplicate checks.
+
+    Gives the same answers as running ingest.are_similar against every indexed
+    transaction, including the "any one posting matches" rule for splits.
+    """
+
+    def __init__(self, entries=()):
+        self.keys = set()
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        if isinstance(entry, data.Transaction):
+            self.keys.update(posting_keys(entry))
+
+    def is_duplicate(self, entry):
+        if not isinstance(entry, data.Transaction):
+            return False
+        return self.has_any(posting_keys(entry))
+
+    def has_any(self, keys):
+        """Check posting keys (see fingerprints.posting_keys) directly."""
+        return any(key in self.keys for key in keys)
+
+
+class BatchIndex:
+    """
+    Posting keys of the transactions taken from earlier files in this run, so
+    overlapping exports of the same account in imports/ aren't both imported.
+
+    Identical transactions within one file (two coffees on the same day) are
+    genuine, so keys are counted: a later file only loses as many copies as
+    the earlier file had. A file's keys only count once its entries have been
+    written (see commit).
+    """
+
+    def __init__(self):
+        # key -> (file it was first taken from, copies in that file)
+        self.sources = {}
+        self.current = None
+        self.pending = {}
+        self.claimed = {}
+
+    def start(self, filepath):
+        """Begin checking the entries of another file."""
+        self.current = filepath
+        self.pending = {}
+        self.claimed = {}
+
+    def duplicate_of(self, keys):
+        """
+        Return the earlier file that already supplied an entry with these
+        posting keys, or None after noting them for the current file.
+        """
+        for key in keys:
+            source = self.sources.get(key)
+            if source is not None:
+                claimed = self.claimed.get(key, 0)
+                if claimed < source[1]:
+                    self.claimed[key] = claimed + 1
+                    return source[0]
+        for key in keys:
+            self.pending[key] = self.pending.get(key, 0) + 1
+        return None
+
+    def commit(self):
+        """Count the current file's entries from now on."""
+        for key, count in self.pending.items():
+            self.sources.setdefault(key, (self.current, count))
+        self.pending = {}
+
+
+# Runs of letters and digits; words with digits in them are dropped (see narration_tokens)
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def narration_tokens(narration):
+    """
+    The words of a narration, lowercased and without the card numbers, dates
+    and references banks add to descriptions ("WOOLWORTHS 1234 SYDNEY
+    Card xx4321" -> {"woolworths", "sydney", "card"}).
+    """
+    return frozenset(token for token in TOKEN_RE.findall((narration or "").lower()) if token.isalpha())
+
+
+def similarity(tokens1, tokens2):
+    """Jaccard similarity of two sets of narration tokens, 1.0 if both are empty."""
+    union = len(tokens1 | tokens2)
+    if not union:
+        return 1.0
+    return len(tokens1 & tokens2) / union
+
+
+class FuzzyIndex:
+    """
+    Finds likely duplicates that DedupIndex misses because the bank moved the
+    date by a day or two or reworded the description, as between the pending
+    and cleared exports of a transaction.
+
+    Transactions are blocked by the (account, cents, currency) of each
+    posting, and every block keeps its dates sorted, so a lookup only scores
+    the narrations of transactions with the same amount within `days` of the
+    new one rather than the whole ledger. Like BatchIndex, the entries of the
+    file being imported only count once they have been written (see commit).
+    """
+
+    def __init__(self, days, threshold, entries=()):
+        self.days = days
+        self.threshold = threshold
+        # block -> (sorted date ordinals, (tokens, date, narration) in the same order)
+        self.blocks = {}
+        self.pending = []
+        self.update(entries)
+
+    @staticmethod
+    def _blocks(entry):
+        return {key[2:] for key in posting_keys(entry) if key[3] is not None}
+
+    def update(self, entries):
+        """Index more existing transactions."""
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            item = (narration_tokens(entry.narration), entry.date, entry.narration)
+            ordinal = entry.date.toordinal()
+            for block in self._blocks(entry):
+                dates, items = self.blocks.setdefault(block, ([], []))
+                # Ledgers load in date order, so this is almost always an append
+                index = bisect.bisect_right(dates, ordinal)
+                dates.insert(index, ordinal)
+                items.insert(index, item)
+
+    def match(self, entry):
+        """
+        Return (score, date, narration) of the most similar indexed
+        transaction sharing a posting amount with entry within the window,
+        or None if none reaches the threshold. Ties go to the nearest date.
+        """
+        tokens = narration_tokens(entry.narration)
+        ordinal = entry.date.toordinal()
+        best = None
+        for block in self._blocks(entry):
+            found = self.blocks.get(block)
+            if found is None:
+                continue
+            dates, items = found
+            start = bisect.bisect_left(dates, ordinal - self.days)
+            end = bisect.bisect_right(dates, ordinal + self.days)
+            for index in range(start, end):
+                other_tokens, other_date, other_narration = items[index]
+                score = similarity(tokens, other_tokens)
+                rank = (score, -abs(dates[index] - ordinal))
+                if score >= self.threshold and (best is None or rank > best[0]):
+                    best = (rank, other_date, other_narration)
+        if best is None:
+            return None
+        return best[0][0], best[1], best[2]
+
+    def flag(self, entries):
+        """
+        Mark the likely duplicates in a stream of new entries for review, with
+        duplicate_of and duplicate_score metadata naming the closest match.
+        """
+        for entry in entries:
+            if isinstance(entry, data.Transaction):
+                found = self.match(entry)
+                if found is not None:
+                    score, other_date, other_narration = found
+                    meta = dict(entry.meta)
+                    meta["duplicate_of"] = f"{other_date} {other_narration or ''}".rstrip()
+                    meta["duplicate_score"] = f"{score:.2f}"
+                    entry = entry._replace(flag=flags.FLAG_WARNING, meta=meta)
+                self.pending.append(entry)
+            yield entry
+
+    def start(self):
+        """Begin checking the entries of another file."""
+        self.pending = []
+
+    def commit(self):
+        """Match later files against the current file's entries from now on."""
+        self.update(self.pending)
+        self.pending = []
@@ -0,0 +1,56 @@
+import os
+
+
+def find_files(ingest_dir):
+    """
+    Yield the absolute path of every non-hidden file under ingest_dir, in a
+    stable order so the same file wins each time a duplicate is dropped.
+    """
+    for root, dirs, files in os.walk(ingest_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            # Skip hidden files
+            if filename.startswith("."):
+                continue
+            yield os.path.abspath(os.path.join(root, filename))
+
+
+# Names browsers give downloads that are still in progress
+PARTIAL_SUFFIXES = (".crdownload", ".part", ".partial", ".download", ".tmp")
+
+
+class FileWatcher:
+    """
+    Polls a directory for files that are new, or changed since they were
+    last returned. A file is only returned once it hasn't been modified for
+    `settle` seconds, so a download that is still being written isn't read
+    half way.
+    """
+
+    def __init__(self, directory, settle):
+        self.directory = directory
+        self.settle = settle
+        # path -> (size, mtime) when it was returned
+        self.seen = {}
+
+    def poll(self, now):
+        """Return the files ready to import at wall-clock time now."""
+        ready = []
+        present = set()
+        for filepath in find_files(self.directory):
+            if filepath.endswith(PARTIAL_SUFFIXES):
+                continue
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+            present.add(filepath)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.seen.get(filepath) == signature or now - stat.st_mtime < self.settle:
+                continue
+            self.seen[filepath] = signature
+            ready.append(filepath)
+        # Archived files are forgotten, so a new export of the same name is imported
+        for filepath in self.seen.keys() - present:
+            del self.seen[filepath]
+        return ready
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import sqlite3
+from datetime import date, timedelta
+from decimal import Decimal
+
+from beancount.core import data
+
+import ledger_files
+
+FINGERPRINT_FILENAME = "fingerprints.sqlite"
+
+
+def cents(number):
+    """
+    Express an amount in integer cents, or as a Decimal number of cents if it
+    is more precise than that (1.505 -> Decimal("150.5")). Equal amounts give
+    equal, equally hashed values either way.
+    """
+    if not isinstance(number, Decimal):
+        return number
+    value = number.scaleb(2)
+    if value.is_finite() and value == value.to_integral_value():
+        return int(value)
+    return value
+
+
+def posting_keys(entry):
+    """Yield the (date, narration, account, cents, currency) keys of a transaction's postings.
+
+    Two transactions are similar (see ingest.are_similar) exactly when they
+    share at least one of these keys. Keys are plain tuples so importers can
+    produce them for rows they haven't turned into Transactions yet.
+    """
+    for posting in entry.postings:
+        units = posting.units
+        if units is None:
+            yield (entry.date, entry.narration, posting.account, None, None)
+        else:
+            yield (entry.date, entry.narration, posting.account, cents(units.number), units.currency)
+
+
+def _number_str(value):
+    # Equal amounts must give equal strings, whatever their precision (100.0 == 100.00)
+    if value is None:
+        return str(value)
+    number = Decimal(value).scaleb(-2)
+    if not number.is_finite():
+        return str(number)
+    if number == 0:
+        return "0"
+    return str(number.normalize())
+
+
+def fingerprint(key):
+    """Hash a posting key into a compact digest suitable for on-disk storage."""
+    txn_date, narration, account, value, currency = key
+    if value is None and currency is None:
+        units_str = "\x00"
+    else:
+        units_str = f"{_number_str(value)} {currency}"
+    narration_str = "\x00" if narration is None else narration
+    raw = "\x1f".join([txn_date.isoformat(), narration_str, account, units_str])
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest()
+
+
+def _source_stats(ledgers_dir):
+    stats = {}
+    for path in ledger_files.year_files(ledgers_dir).values():
+        st = os.stat(path)
+        stats[os.path.basename(path)] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+
+class FingerprintStore:
+    """
+    A local SQLite store of posting fingerprints for every transaction in the
+    year files (ledgers/YYYY.bean), maintained by merge_ledger.py so ingest can
+    de-duplicate without parsing the ledger.
+
+    It also records the size and mtime of each year file it has seen, so hand
+    edits to them can be detected (see is_stale) and fixed with a rebuild.
+    Only the year files are covered: transactions in main.bean or other
+    included files aren't indexed, and changes to those files go unnoticed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (digest BLOB PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sources (
+                filename TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                account TEXT PRIMARY KEY, date TEXT, balance TEXT, currency TEXT
+            );
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def add_entries(self, entries):
+        """Record the fingerprints of all transactions in entries."""
+        digests = (
+            (fingerprint(key),)
+            for entry in entries
+            if isinstance(entry, data.Transaction)
+            for key in posting_keys(entry)
+        )
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO fingerprints (digest) VALUES (?)", digests
+            )
+
+    def is_duplicate(self, entry):
+        """Same contract as dedup_index.DedupIndex.is_duplicate."""
+        if not isinstance(entry, data.Transaction):
+            return False
+        return self.has_any(posting_keys(entry))
+
+    def has_any(self, keys):
+        """Same contract as dedup_index.DedupIndex.has_any."""
+        digests = [fingerprint(key) for key in keys]
+        if not digests:
+            return False
+        placeholders = ",".join("?" * len(digests))
+        row = self.conn.execute(
+            f"SELECT 1 FROM fingerprints WHERE digest IN ({placeholders}) LIMIT 1",
+            digests,
+        ).fetchone()
+        return row is not None
+
+    def record_sources(self, ledgers_dir):
+        """Remember the current state of the year files as being in sync."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('ledgers_dir', ?)",
+                (os.path.abspath(ledgers_dir),),
+            )
+            self.conn.execute("DELETE FROM sources")
+            self.conn.executemany(
+                "INSERT INTO sources (filename, mtime_ns, size) VALUES (?, ?, ?)",
+                [(name, *stat) for name, stat in _source_stats(ledgers_dir).items()],
+            )
+
+    def is_stale(self, ledgers_dir=None):
+        """
+        True if any year file was added, removed or edited since the last
+        sync. Other ledger files aren't tracked (see FingerprintStore).
+        """
+        if ledgers_dir is None:
+            row = self.conn.execute(
+                "SELECT value FROM settings WHERE key = 'ledgers_dir'"
+            ).fetchone()
+            if row is None:
+                return True
+            ledgers_dir = row[0]
+        recorded = {
+            name: (mtime_ns, size)
+            for name, mtime_ns, size in self.conn.execute(
+                "SELECT filename, mtime_ns, size FROM sources"
+            )
+        }
+        return recorded != _source_stats(ledgers_dir)
+
+    def update_watermarks(self, entries):
+        """
+        Move each account's watermark up to the newest balance assertion in
+        entries: the balance at the start of its date is the closing balance of
+        the day before, the last one imported. Watermarks never move back.
+        """
+        marks = self.watermarks()
+        for entry in entries:
+            if isinstance(entry, data.Balance):
+                last_date = entry.date - timedelta(days=1)
+                current = marks.get(entry.account)
+                if current is None or last_date > current[0]:
+                    marks[entry.account] = (last_date, entry.amount.number, entry.amount.currency)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO watermarks (account, date, balance, currency) VALUES (?, ?, ?, ?)",
+                [
+                    (account, last_date.isoformat(), str(balance), currency)
+                    for account, (last_date, balance, currency) in marks.items()
+                ],
+            )
+
+    def watermarks(self):
+        """Return {account: (date, balance, currency)} of the newest imported statement rows."""
+        return {
+            account: (date.fromisoformat(last_date), Decimal(balance), currency)
+            for account, last_date, balance, currency in self.conn.execute(
+                "SELECT account, date, balance, currency FROM watermarks"
+            )
+        }
+
+    def rebuild(self, ledgers_dir):
+        """
+        Regenerate the store from scratch from ledgers/*.bean. Watermarks are
+        dropped, since hand edits may have removed imported rows; the next
+        merge sets them again.
+        """
+        paths = ledger_files.year_files(ledgers_dir).values()
+        entries = ledger_files.load_entries(paths)
+        with self.conn:
+            self.conn.execute("DELETE FROM fingerprints")
+            self.conn.execute("DELETE FROM watermarks")
+        self.add_entries(entries)
+        self.record_sources(ledgers_dir)
+        return len(entries)
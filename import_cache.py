@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def dependencies_digest(paths, settings=""):
+    """
+    Hash the contents of the files that affect what importers extract, plus
+    any other settings that do (e.g. watermarks).
+    """
+    digest = hashlib.sha256(settings.encode("utf-8"))
+    for path in paths:
+        digest.update(path.encode("utf-8") + b"\0")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def read_entries(path):
+    """Yield the entries pickled one after another in path."""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+class ImportCache:
+    """
+    Remembers what ingest extracted from each file in imports/, keyed by the
+    file's content hash, so unchanged files aren't identified and extracted
+    again on the next run.
+
+    The manifest records the hash, the importers that matched and how many
+    entries each produced; the entries (or compact rows, for importers with
+    iter_rows) are pickled next to it, before de-duplication. The
+    whole cache is dropped when any dependency (user_rules.yaml, config.py,
+    importer code) or setting changes.
+    """
+
+    def __init__(self, cache_dir, dependencies, settings=""):
+        self.cache_dir = cache_dir
+        self.dependencies = dependencies_digest(dependencies, settings)
+        self.files = {}
+        # Files looked up or recorded during this run; only these are kept
+        self.current = {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest = self._read_manifest()
+        if manifest.get("dependencies") == self.dependencies:
+            self.files = manifest.get("files", {})
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.cache_dir, MANIFEST_FILENAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _entries_path(self, digest, position):
+        return os.path.join(self.cache_dir, f"{digest}.{position}.pickle")
+
+    def lookup(self, filepath, digest, needs=()):
+        """
+        Return the manifest record for a file if it is unchanged and has the
+        extra fields in needs (see _Recorder.extra), otherwise None.
+        """
+        record = self.files.get(filepath)
+        if record is None or record["hash"] != digest or any(field not in record for field in needs):
+            return None
+        for position in range(len(record["importers"])):
+            if not os.path.exists(self._entries_path(digest, position)):
+                return None
+        self.current[filepath] = record
+        return record
+
+    def replay(self, record, importers):
+        """Yield (importer, entries) as they were extracted when record was made."""
+        for position, (index, _name, _count) in enumerate(record["importers"]):
+            yield importers[index], read_entries(self._entries_path(record["hash"], position))
+
+    def recorder(self, filepath, digest):
+        return _Recorder(self, filepath, digest)
+
+    def save(self):
+        """Write the manifest and delete cached entries of files no longer present."""
+        manifest = {"dependencies": self.dependencies, "files": self.current}
+        path = os.path.join(self.cache_dir, MANIFEST_FILENAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+        keep = {
+            os.path.basename(self._entries_path(record["hash"], position))
+            for record in self.current.values()
+            for position in range(len(record["importers"]))
+        }
+        for filename in os.listdir(self.cache_dir):
+            if filename != MANIFEST_FILENAME and filename not in keep:
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except OSError as e:
+                    print(f"Warning: could not remove {filename} from cache: {e}", file=sys.stderr)
+
+
+class _Recorder:
+    """Writes a file's entries to the cache as they stream past."""
+
+    def __init__(self, cache, filepath, digest):
+        self.cache = cache
+        self.filepath = filepath
+        self.digest = digest
+        self.importers = []
+        # Anything else worked out about the file, kept in its manifest record
+        self.extra = {}
+
+    def record(self, index, importer, entries):
+        """Pass entries through, pickling each one; only complete runs are kept."""
+        position = len(self.importers)
+        self.importers.append([index, importer.__class__.__name__, 0])
+        path = self.cache._entries_path(self.digest, position)
+        with open(path + ".tmp", "wb") as f:
+            for entry in entries:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+                self.importers[position][2] += 1
+                yield entry
+        os.replace(path + ".tmp", path)
+
+    def commit(self):
+        record = {"hash": self.digest, "importers": self.importers, **self.extra}
+        self.cache.files[self.filepath] = record
+        self.cache.current[self.filepath] = record
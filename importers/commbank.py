@@ -1,16 +1,169 @@
 import csv
+import functools
 import os
 import re
-from datetime import datetime, timedelta
+import sys
+from datetime import date as Date
+from datetime import datetime
+from decimal import Decimal
 from typing import TextIO
 
 from beancount.core import amount, data, flags, number
 from beangulp import importer
 
+from importers.dispatch import SourceFile
+
 try:
-    from category_map import CATEGORY_RULES
+    from category_map import RULE_ENGINE
 except ImportError:
-    CATEGORY_RULES = {}
+    RULE_ENGINE = None
+
+# The fixed dd/mm/yyyy layout used by CommBank exports
+DATE_RE = re.compile(r"(\d\d)/(\d\d)/(\d\d\d\d)", re.ASCII)
+
+UNCATEGORIZED = "Expenses:Uncategorized"
+
+# Plain amounts such as "-50.00"; anything else (e.g. "1,234.56") goes through number.D
+AMOUNT_RE = re.compile(r"[+-]?\d+(?:\.\d+)?", re.ASCII)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(date_str):
+    """
+    Parse a dd/mm/yyyy date by slicing the fields directly, falling back to
+    strptime for anything else it accepts. Cached, since statements repeat
+    the same dates many times.
+    """
+    match = DATE_RE.fullmatch(date_str)
+    if match:
+        day, month, year = match.groups()
+        return Date(int(year), int(month), int(day))
+    return datetime.strptime(date_str, "%d/%m/%Y").date()
+
+
+# Amounts with exactly two decimals, which is nearly all of them
+CENTS_RE = re.compile(r"([+-]?\d+)\.(\d\d)", re.ASCII)
+
+
+def parse_amount(amt_str):
+    if AMOUNT_RE.fullmatch(amt_str):
+        return Decimal(amt_str)
+    return number.D(amt_str)
+
+
+def parse_cents(amt_str):
+    """
+    Parse an amount into integer cents. Anything else ("1,234.5", "0.125",
+    or "-0.00", whose sign an int would lose) becomes a Decimal number of
+    cents that keeps the original precision.
+    """
+    match = CENTS_RE.fullmatch(amt_str)
+    if match:
+        whole, fraction = match.groups()
+        value = int(whole + fraction)
+        if value or not whole.startswith("-"):
+            return value
+    return parse_amount(amt_str).scaleb(2)
+
+
+def from_cents(value):
+    """The Decimal amount for a value from parse_cents, e.g. -5000 -> -50.00."""
+    return Decimal(value).scaleb(-2)
+
+
+class StatementRow:
+    """
+    One CSV row in compact form, before it becomes a Transaction: an ordinal
+    date, the amount and running balance in cents (see parse_cents), the
+    interned description and the categorization rule that matched it (if any).
+    """
+
+    __slots__ = ("balance", "cents", "description", "filename", "lineno", "ordinal", "rule")
+
+    def __init__(self, filename, lineno, ordinal, cents, balance, description, rule):
+        self.filename = filename
+        self.lineno = lineno
+        self.ordinal = ordinal
+        self.cents = cents
+        self.balance = balance
+        self.description = description
+        self.rule = rule
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+# Beyond this, the balance column is probably not what we think it is
+MAX_BALANCE_WARNINGS = 20
+
+
+class BalanceContinuity:
+    """
+    Follows a statement's running balance column row by row, collecting rows
+    that look duplicated and places where the balance doesn't follow on from
+    the row before (usually rows missing from the export).
+
+    Exports come newest-first or oldest-first, so breaks are tracked both ways
+    and the file's date order decides which ones are reported.
+    """
+
+    def __init__(self):
+        self.previous = None
+        self.first_ordinal = None
+        # The latest row seen with each balance, to tell duplicates from gaps
+        self.by_balance = {}
+        self.duplicates = []
+        self.breaks = {"oldest-first": [], "newest-first": []}
+
+    def add(self, row):
+        previous = self.previous
+        if previous is None:
+            self.first_ordinal = row.ordinal
+        else:
+            broken = False
+            if row.balance != previous.balance + row.cents:
+                self.breaks["oldest-first"].append((previous, row, previous.balance + row.cents))
+                broken = True
+            if previous.balance != row.balance + previous.cents:
+                self.breaks["newest-first"].append((previous, row, previous.balance - previous.cents))
+                broken = True
+            # A repeated row always breaks the balance sequence, so only look then
+            earlier = self.by_balance.get(row.balance) if broken else None
+            if earlier is not None and (earlier.ordinal, earlier.cents, earlier.description) == (
+                row.ordinal,
+                row.cents,
+                row.description,
+            ):
+                self.duplicates.append((row.lineno, earlier.lineno))
+        self.by_balance[row.balance] = row
+        self.previous = row
+
+    def order(self):
+        last_ordinal = self.previous.ordinal if self.previous else None
+        if self.first_ordinal != last_ordinal:
+            return "oldest-first" if self.first_ordinal < last_ordinal else "newest-first"
+        # All on one day: go with whichever order fits the balances better
+        return min(self.breaks, key=lambda order: len(self.breaks[order]))
+
+    def problems(self):
+        """Return (line number, message) pairs, with 1-based line numbers, in file order."""
+        if self.previous is None:
+            return []
+        problems = [(line + 1, f"duplicates line {first + 1}") for line, first in self.duplicates]
+        duplicated = {line for line, _ in self.duplicates}
+        for previous, row, expected in self.breaks[self.order()]:
+            if row.lineno in duplicated:
+                continue
+            message = (
+                f"balance {from_cents(row.balance)} doesn't follow from line {previous.lineno + 1}"
+                f" (expected {from_cents(expected)}), rows may be missing"
+            )
+            problems.append((row.lineno + 1, message))
+        return sorted(problems)
 
 
 class CommBankImporter(importer.ImporterProtocol):
@@ -18,8 +171,16 @@ class CommBankImporter(importer.ImporterProtocol):
         self.account = account
         self.filename_pattern = filename_pattern
         self.currency = currency
+        # (date, balance) of the newest row already in the ledger; set by ingest
+        self.watermark = None
+        self._filename_re = (
+            re.compile(filename_pattern, re.IGNORECASE) if filename_pattern else None
+        )
 
     def _open_file(self, file) -> TextIO:
+        # Files routed by the dispatcher have already been read
+        if isinstance(file, SourceFile):
+            return file.open()
         return open(file.name)
 
     def identify(self, file):
@@ -28,11 +189,9 @@ class CommBankImporter(importer.ImporterProtocol):
             return False
 
         # Check filename pattern if specified
-        if self.filename_pattern:
+        if self._filename_re:
             # We check against the basename to avoid path issues
-            if not re.search(
-                self.filename_pattern, os.path.basename(file.name), re.IGNORECASE
-            ):
+            if not self._filename_re.search(os.path.basename(file.name)):
                 return False
 
         try:
@@ -43,80 +202,230 @@ class CommBankImporter(importer.ImporterProtocol):
                 # Check for 4 columns and date format in first column
                 if len(row) != 4:
                     return False
-                datetime.strptime(row[0], "%d/%m/%Y")
+                parse_date(row[0])
                 return True
         except Exception:
             return False
 
     def extract(self, file, existing_entries=None):
-        entries = []
-        last_balance = None
-        last_date = None
-        index = -1
+        entries = list(self.iter_extract(file))
+
+        # Sort entries by date (and other criteria) to ensure chronological order
+        entries.sort(key=data.entry_sortkey)
+
+        return entries
+
+    def date_range(self, file):
+        """
+        Return the (first, last) transaction dates in the file, or None if it
+        has no rows. Only the date column is parsed.
+        """
+        first = last = None
+        with self._open_file(file) as f:
+            for row in csv.reader(f):
+                date = parse_date(row[0])
+                if first is None or date < first:
+                    first = date
+                if last is None or date > last:
+                    last = date
+        if first is None:
+            return None
+        return first, last
+
+    def _row(self, filename, index, ordinal, row):
+        desc = sys.intern(row[2])
+        rule = RULE_ENGINE.match(desc) if RULE_ENGINE else None
+        return StatementRow(filename, index, ordinal, parse_cents(row[1]), parse_cents(row[3]), desc, rule)
+
+    def iter_rows(self, file):
+        """
+        Yield a StatementRow per CSV row, in file order, followed by the closing
+        balance assertion. Rows are categorized but no Beancount objects are
+        built for them, so ingest can drop duplicates (see row_keys) first and
+        only call build_entry for the rest.
+
+        With a watermark, rows dated before it are skipped after reading just
+        their date. Rows on its date are new only if they come after the row
+        whose running balance equals the watermark's. A file that ends before
+        the watermark date is an older statement being backfilled, and is
+        read in full. How many rows were skipped is reported on stderr.
+        """
+        mark_ordinal = mark_balance = None
+        if self.watermark is not None:
+            mark_ordinal = self.watermark[0].toordinal()
+            mark_balance = self.watermark[1].scaleb(2)
+
+        first = last = None
+        # Rows on the watermark date, until it is clear which way the file runs
+        held = []
+        seen_newer = seen_older = False
+        # Rows before the watermark date, until a row reaches it
+        older = []
+        reached = False
+        read = skipped = 0
 
         with self._open_file(file) as f:
             reader = csv.reader(f)
             for index, row in enumerate(reader):
-                date_str = row[0]
-                amt_str = row[1]
-                desc = row[2]
-
-                # Parse date
-                date = datetime.strptime(date_str, "%d/%m/%Y").date()
-
-                # Parse amount
-                amt = number.D(amt_str)
-                units = amount.Amount(amt, self.currency)
-
-                # Categorization
-                category = "Expenses:Uncategorized"
-                flag = flags.FLAG_WARNING
-                tags = frozenset(["review"])
-
-                for pattern, account in CATEGORY_RULES.items():
-                    if re.search(pattern, desc, re.IGNORECASE):
-                        category = account
-                        flag = flags.FLAG_OKAY
-                        tags = data.EMPTY_SET
-                        break
-
-                meta = data.new_metadata(file.name, index)
-
-                txn = data.Transaction(
-                    meta,
-                    date,
-                    flag,
-                    None,
-                    desc,
-                    tags,
-                    data.EMPTY_SET,
-                    [
-                        data.Posting(self.account, units, None, None, None, None),
-                        data.Posting(category, -units, None, None, None, None),
-                    ],
-                )
-                entries.append(txn)
-
-                # Track for balance assertion
-                last_balance = number.D(row[3])
-                last_date = date
-
-        if entries and last_balance is not None and last_date is not None:
+                read += 1
+                ordinal = parse_date(row[0]).toordinal()
+                if first is None:
+                    first = (index, ordinal, row[3])
+                last = (index, ordinal, row[3])
+                if not reached and (mark_ordinal is None or ordinal >= mark_ordinal):
+                    reached = True
+                    older = []
+
+                if mark_ordinal is None or ordinal > mark_ordinal:
+                    if held:
+                        # Newer rows after the watermark date: oldest-first
+                        rows = self._after_watermark(file.name, held, False)
+                        skipped += len(held) - len(rows)
+                        yield from rows
+                        held = []
+                    seen_newer = True
+                    yield self._row(file.name, index, ordinal, row)
+                elif ordinal == mark_ordinal:
+                    held.append((index, row))
+                else:
+                    if held:
+                        rows = self._after_watermark(file.name, held, True)
+                        skipped += len(held) - len(rows)
+                        yield from rows
+                        held = []
+                    seen_older = True
+                    skipped += 1
+                    if not reached:
+                        older.append((index, ordinal, row))
+
+        if held:
+            newest_first = True if seen_newer else False if seen_older else None
+            rows = self._after_watermark(file.name, held, newest_first)
+            skipped += len(held) - len(rows)
+            yield from rows
+
+        if not reached and older:
+            # Nothing as recent as the watermark: a backfill, so nothing was imported yet
+            print(
+                f"; {os.path.basename(file.name)} ends before the {self.account} watermark "
+                f"({self.watermark[0]}), reading all of it",
+                file=sys.stderr,
+            )
+            for index, ordinal, row in older:
+                yield self._row(file.name, index, ordinal, row)
+            mark_ordinal = None
+        elif mark_ordinal is not None and read:
+            print(
+                f"; Skipped {skipped} of {read} rows of {os.path.basename(file.name)} "
+                f"up to the {self.account} watermark ({self.watermark[0]})",
+                file=sys.stderr,
+            )
+
+        if first is not None:
+            # The closing balance is on the newest row, which is the first one
+            # in a newest-first file
+            _, ordinal, balance_str = first if first[1] > last[1] else last
+            balance = parse_cents(balance_str)
+            if mark_ordinal is not None and (
+                ordinal < mark_ordinal or (ordinal == mark_ordinal and balance == mark_balance)
+            ):
+                # Already asserted in the ledger
+                return
+
             # Add balance assertion for the day after the last transaction
             # This asserts the balance at the START of the next day
-            balance_date = last_date + timedelta(days=1)
-
             balance_entry = data.Balance(
-                data.new_metadata(file.name, index + 1),
-                balance_date,
+                data.new_metadata(file.name, last[0] + 1),
+                Date.fromordinal(ordinal + 1),
                 self.account,
-                amount.Amount(last_balance, self.currency),
+                amount.Amount(from_cents(balance), self.currency),
                 None,
                 None,
             )
-            entries.append(balance_entry)
+            yield balance_entry
 
-        # Sort entries by date (and other criteria) to ensure chronological order
-        entries.sort(key=data.entry_sortkey)
+    def _after_watermark(self, filename, held, newest_first):
+        """Return the rows on the watermark date that weren't imported yet."""
+        mark_ordinal = self.watermark[0].toordinal()
+        mark_balance = self.watermark[1].scaleb(2)
+        balances = [parse_cents(row[3]) for _, row in held]
+        if newest_first is None or mark_balance not in balances:
+            # Can't tell which rows are new; dedup will sort it out
+            kept = held
+        elif newest_first:
+            # Imported rows are below the match; with repeated balances keep
+            # the most rows, since dedup catches any that were imported
+            kept = held[: len(balances) - 1 - balances[::-1].index(mark_balance)]
+        else:
+            kept = held[balances.index(mark_balance) + 1 :]
+        return [self._row(filename, index, mark_ordinal, row) for index, row in kept]
 
-        return entries
+    def check_balances(self, items):
+        """
+        Pass the items of iter_rows through unchanged while checking the
+        running balance column (see BalanceContinuity), then warn on stderr
+        about rows that look missing or duplicated.
+        """
+        check = BalanceContinuity()
+        filename = None
+        for item in items:
+            if isinstance(item, StatementRow):
+                check.add(item)
+                filename = item.filename
+            yield item
+        problems = check.problems()
+        for line, message in problems[:MAX_BALANCE_WARNINGS]:
+            print(f"Warning: {filename}:{line}: {message}", file=sys.stderr)
+        if len(problems) > MAX_BALANCE_WARNINGS:
+            print(
+                f"Warning: {filename}: {len(problems) - MAX_BALANCE_WARNINGS} more balance problems",
+                file=sys.stderr,
+            )
+
+    def row_keys(self, row):
+        """The fingerprints.posting_keys of the Transaction build_entry would make."""
+        date = Date.fromordinal(row.ordinal)
+        category = row.rule.account if row.rule else UNCATEGORIZED
+        return (
+            (date, row.description, self.account, row.cents, self.currency),
+            (date, row.description, category, -row.cents, self.currency),
+        )
+
+    def build_entry(self, row):
+        units = amount.Amount(from_cents(row.cents), self.currency)
+
+        # Categorization
+        category = UNCATEGORIZED
+        flag = flags.FLAG_WARNING
+        tags = frozenset(["review"])
+        meta = data.new_metadata(row.filename, row.lineno)
+
+        if row.rule:
+            category = row.rule.account
+            flag = flags.FLAG_OKAY
+            tags = data.EMPTY_SET
+            # Record which rule fired so it can be checked during review
+            meta["category_rule"] = row.rule.pattern
+
+        return data.Transaction(
+            meta,
+            Date.fromordinal(row.ordinal),
+            flag,
+            None,
+            row.description,
+            tags,
+            data.EMPTY_SET,
+            [
+                data.Posting(self.account, units, None, None, None, None),
+                data.Posting(category, -units, None, None, None, None),
+            ],
+        )
+
+    def iter_extract(self, file):
+        """
+        Yield transactions one row at a time, in file order, followed by the
+        closing balance assertion. Unlike extract(), nothing is sorted or held
+        in memory.
+        """
+        for item in self.check_balances(self.iter_rows(file)):
+            yield self.build_entry(item) if isinstance(item, StatementRow) else item
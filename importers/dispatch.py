@@ -0,0 +1,91 @@
+import hashlib
+import io
+import mimetypes
+import os
+import re
+
+
+class SourceFile:
+    """
+    A file to import, read from disk at most once. Every importer's identify
+    and the matching importer's extract share the same buffer.
+
+    Offers the parts of beangulp's file memo API that importers use (name,
+    head, contents, mimetype).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._data = None
+        self._contents = None
+        self._digest = None
+
+    def data(self):
+        if self._data is None:
+            with open(self.name, "rb") as f:
+                self._data = f.read()
+        return self._data
+
+    def contents(self):
+        if self._contents is None:
+            # Decode exactly as open(name) would, newline translation included
+            self._contents = io.TextIOWrapper(io.BytesIO(self.data())).read()
+        return self._contents
+
+    def digest(self):
+        """SHA-256 of the raw file contents."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data()).hexdigest()
+        return self._digest
+
+    def head(self, num_chars=8192):
+        return self.contents()[:num_chars]
+
+    def mimetype(self):
+        mtype, _ = mimetypes.guess_type(self.name, strict=False)
+        return mtype
+
+    def open(self):
+        return io.StringIO(self.contents())
+
+
+class Dispatcher:
+    """
+    Routes files to the importers that identify them.
+
+    Each importer's filename_pattern is compiled once up front and checked
+    against the file name before identify, so files no importer is
+    interested in are never opened.
+    """
+
+    def __init__(self, importers):
+        self.importers = list(importers)
+        self._filename_res = []
+        for importer in self.importers:
+            pattern = getattr(importer, "filename_pattern", None)
+            self._filename_res.append(re.compile(pattern, re.IGNORECASE) if pattern else None)
+
+    def route(self, source):
+        """Return the importers that identify source, in configuration order."""
+        basename = os.path.basename(source.name)
+        matches = []
+        for importer, filename_re in zip(self.importers, self._filename_res):
+            if filename_re and not filename_re.search(basename):
+                continue
+            if importer.identify(source):
+                matches.append(importer)
+        return matches
+
+
+def probe_date_range(importer, file):
+    """
+    Return the (first, last) dates of the entries in a file, or None if it has
+    none. Uses the importer's lightweight date_range() if it provides one, and
+    falls back to a full extract() otherwise.
+    """
+    if hasattr(importer, "date_range"):
+        return importer.date_range(file)
+    dates = [entry.date for entry in importer.extract(file) if hasattr(entry, "date")]
+    if not dates:
+        return None
+    return min(dates), max(dates)
@@ -0,0 +1,333 @@
+import collections
+import copy
+import glob
+import hashlib
+import os
+import pickle
+import sys
+from datetime import date, timedelta
+
+import beancount
+from beancount import loader
+from beancount.core import data, flags, inventory
+from beancount.ops import summarize, validation
+from beancount.parser import booking, options, parser
+
+from ledger_files import YEAR_FILE_RE
+
+SNAPSHOTS_FILENAME = "snapshots.pickle"
+
+# Source of the opening balance entries replayed from a snapshot
+SNAPSHOT_SOURCE = "<snapshot>"
+
+# Directives from before the starting year that an incremental check still needs
+CARRIED_OVER = (data.Open, data.Close, data.Commodity)
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ParsedFile:
+    """
+    The parse results of one ledger file. A year file's entries from its own
+    year, the bulk of the file, are only unpickled if the check needs them;
+    the rest is always at hand.
+    """
+
+    def __init__(self, path, digest, summary, entries_path, entries=None):
+        self.path = path
+        self.digest = digest
+        match = YEAR_FILE_RE.match(os.path.basename(path))
+        self.year = int(match.group(1)) if match else None
+        # outside: entries not dated in the file's year (all of them for other files)
+        self.errors, self.options_map, self.carried, self.outside = summary
+        self.entries_path = entries_path
+        self._entries = entries
+
+    def entries(self):
+        if self._entries is None:
+            try:
+                with open(self.entries_path, "rb") as f:
+                    self._entries = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self._entries, _, _ = parser.parse_file(self.path)
+        return self._entries
+
+
+class ParseCache:
+    """
+    Parsed directives of each ledger file, pickled under the hash of its
+    contents, so only edited files are parsed again. Parse results of files
+    that weren't used in a run are deleted by prune().
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.used = set()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def parse(self, path):
+        """Return the ParsedFile for path, parsing it only if it changed."""
+        digest = file_digest(path)
+        # Entries record their filename, so a moved file is parsed again
+        key = hashlib.sha256(f"{beancount.__version__}\0{path}\0{digest}".encode()).hexdigest()
+        self.used.add(key)
+        entries_path = os.path.join(self.cache_dir, f"parse-{key}.pickle")
+        summary_path = os.path.join(self.cache_dir, f"parse-{key}.summary.pickle")
+        if os.path.exists(entries_path):
+            try:
+                with open(summary_path, "rb") as f:
+                    return ParsedFile(path, digest, pickle.load(f), entries_path)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+
+        entries, errors, options_map = parser.parse_file(path)
+        parsed = ParsedFile(path, digest, (errors, options_map, [], []), entries_path, entries)
+        year_range = (date(parsed.year, 1, 1), date(parsed.year + 1, 1, 1)) if parsed.year else None
+        parsed.carried = [e for e in entries if isinstance(e, CARRIED_OVER)]
+        parsed.outside = [e for e in entries if year_range is None or not year_range[0] <= e.date < year_range[1]]
+        summary = (errors, options_map, parsed.carried, parsed.outside)
+        for cache_path, value in ((entries_path, entries), (summary_path, summary)):
+            with open(cache_path + ".tmp", "wb") as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + ".tmp", cache_path)
+        return parsed
+
+    def prune(self):
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith("parse-") and filename[6:].split(".")[0] not in self.used:
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except OSError as e:
+                    print(f"Warning: could not remove {filename} from cache: {e}", file=sys.stderr)
+
+
+def parse_ledger(main_file, cache):
+    """
+    Parse main_file and everything it includes, recursively, the way the
+    beancount loader does but through the parse cache.
+
+    Returns (files, errors, options_map), where files maps each parsed file
+    to its ParsedFile, the main file first.
+    """
+    files = {}
+    errors = []
+    options_map = None
+    other_options = []
+    pending = [os.path.normpath(os.path.abspath(main_file))]
+    while pending:
+        path = pending.pop(0)
+        if path in files:
+            errors.append(loader.LoadError(data.new_metadata("<load>", 0), f'Duplicate filename parsed: "{path}"'))
+            continue
+        if not os.path.exists(path):
+            errors.append(loader.LoadError(data.new_metadata("<load>", 0), f'File "{path}" does not exist'))
+            continue
+        parsed = files[path] = cache.parse(path)
+        errors.extend(parsed.errors)
+        if options_map is None:
+            options_map = parsed.options_map
+        else:
+            other_options.append(parsed.options_map)
+
+        base_dir = os.path.dirname(path)
+        for pattern in parsed.options_map["include"]:
+            matches = glob.glob(os.path.join(base_dir, pattern), recursive=True)
+            if not matches:
+                errors.append(
+                    loader.LoadError(data.new_metadata("<load>", 0), f'File glob "{pattern}" does not match any files')
+                )
+            pending.extend(os.path.normpath(os.path.join(base_dir, match)) for match in matches)
+
+    options_map = loader.aggregate_options_map(options_map, other_options)
+    options_map["include"] = sorted(files)
+    return files, errors, options_map
+
+
+def _without_location(meta):
+    return {key: value for key, value in (meta or {}).items() if key not in ("filename", "lineno")}
+
+
+def _entry_text(entry):
+    # Line numbers shift with any edit above an entry, which doesn't change it
+    entry = entry._replace(meta=_without_location(entry.meta))
+    if isinstance(entry, data.Transaction):
+        entry = entry._replace(
+            postings=[posting._replace(meta=_without_location(posting.meta)) for posting in entry.postings]
+        )
+    return repr(entry)
+
+
+def snapshot_keys(main_file, files, years):
+    """
+    Return {year: key}, where a key changes whenever anything dated before
+    that year may have: the main file itself, earlier year files, and the
+    directives dated before that year in any other file (e.g. the Open
+    directives in accounts.bean).
+    """
+    main = next(iter(files.values()))
+    keys = {}
+    for year in years:
+        start = date(year, 1, 1)
+        digest = hashlib.sha256(f"{beancount.__version__}\0{os.path.abspath(main_file)}\0{main.digest}".encode())
+        for parsed in files.values():
+            if parsed is main:
+                continue
+            digest.update(f"\0{parsed.path}\0".encode())
+            if parsed.year is not None and parsed.year < year:
+                digest.update(parsed.digest.encode())
+                continue
+            for entry in parsed.outside:
+                if entry.date < start:
+                    digest.update(_entry_text(entry).encode())
+                    digest.update(b"\n")
+        keys[year] = digest.hexdigest()
+    return keys
+
+
+def entries_from(files, start_year):
+    """
+    The entries an incremental check starting on January 1st of start_year
+    needs: everything from that date on, and the directives in CARRIED_OVER.
+    Year files from before start_year aren't unpickled.
+    """
+    start = date(start_year, 1, 1)
+    entries = []
+    for parsed in files.values():
+        if parsed.year is not None and parsed.year < start_year:
+            entries.extend(e for e in parsed.carried if e.date < start)
+            entries.extend(e for e in parsed.outside if e.date >= start)
+        else:
+            entries.extend(e for e in parsed.entries() if e.date >= start or isinstance(e, CARRIED_OVER))
+    return entries
+
+
+def balances_by_year(entries, years):
+    """
+    Return {year: {account: Inventory}} with the balances at the start of
+    each year, from one pass over the booked entries.
+    """
+    balances = collections.defaultdict(inventory.Inventory)
+    result = {}
+    remaining = sorted(years)
+    for entry in entries:
+        while remaining and entry.date >= date(remaining[0], 1, 1):
+            result[remaining.pop(0)] = copy.deepcopy(dict(balances))
+        if isinstance(entry, data.Transaction):
+            for posting in entry.postings:
+                balances[posting.account].add_position(posting)
+    for year in remaining:
+        result[year] = copy.deepcopy(dict(balances))
+    return result
+
+
+def _error_date(error):
+    return getattr(error.entry, "date", None) if error.entry is not None else None
+
+
+def _read_snapshots(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, SNAPSHOTS_FILENAME), "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def _write_snapshots(cache_dir, snapshots):
+    path = os.path.join(cache_dir, SNAPSHOTS_FILENAME)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(snapshots, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def _opening_entries(balances, year, options_map, opened):
+    """Entries that put the accounts in the state they were in on January 1st."""
+    opening_account = options.get_previous_accounts(options_map)[1]
+    last_day = date(year, 1, 1) - timedelta(days=1)
+    meta = data.new_metadata(SNAPSHOT_SOURCE, 0)
+    entries = summarize.create_entries_from_balances(
+        balances,
+        last_day,
+        opening_account,
+        True,
+        meta,
+        flags.FLAG_SUMMARIZE,
+        "Opening balance for '{account}' (check snapshot)",
+    )
+    if entries and opening_account not in opened:
+        entries.insert(0, data.Open(meta, last_day, opening_account, None, None))
+    return entries
+
+
+def check(main_file, cache_dir, full=False):
+    """
+    Validate the ledger like bean-check, without re-doing the work for years
+    that haven't changed.
+
+    Each file's parsed directives are cached by content hash, and every clean
+    run records the balances of all accounts at the start of each year with
+    a year file. Later runs start from the newest year whose earlier inputs
+    are unchanged: earlier transactions are replaced by opening balances (the
+    Open, Close and Commodity directives are kept), so only that year onwards
+    is booked, run through the plugins and validated. Errors dated before
+    that year can't occur, since snapshots are only kept from clean years.
+
+    Returns (errors, year the check started from, or None for a full check).
+    """
+    cache = ParseCache(cache_dir)
+    files, errors, options_map = parse_ledger(main_file, cache)
+    cache.prune()
+
+    years = sorted(parsed.year for parsed in files.values() if parsed.year is not None)[1:]
+    keys = snapshot_keys(main_file, files, years)
+    snapshots = {} if full else _read_snapshots(cache_dir)
+
+    start_year = None
+    for year in reversed(years):
+        snapshot = snapshots.get(year)
+        if snapshot is not None and snapshot[0] == keys[year]:
+            start_year = year
+            break
+
+    initial_balances = None
+    if start_year is None:
+        entries = [entry for parsed in files.values() for entry in parsed.entries()]
+    else:
+        entries = entries_from(files, start_year)
+        balances = snapshots[start_year][1]
+        initial_balances = collections.defaultdict(inventory.Inventory, copy.deepcopy(balances))
+
+    entries.sort(key=data.entry_sortkey)
+    entries, booking_errors = booking.book(entries, options_map, initial_balances)
+    errors.extend(booking_errors)
+    if start_year is not None:
+        opened = {e.account for parsed in files.values() for e in parsed.carried if isinstance(e, data.Open)}
+        entries = entries + _opening_entries(balances, start_year, options_map, opened)
+        entries.sort(key=data.entry_sortkey)
+
+    saved_path = list(sys.path)
+    try:
+        sys.path[0:0] = options_map.get("pythonpath", [])
+        entries, errors = loader.run_transformations(entries, errors, options_map, None)
+    finally:
+        sys.path[:] = saved_path
+    errors.extend(validation.validate(entries, options_map, None, None))
+    # The opening entries stand for transactions that were already validated
+    errors = [e for e in errors if (e.source or {}).get("filename") != SNAPSHOT_SOURCE]
+
+    # Keep snapshots up to the first error; undated errors (e.g. syntax) taint every year
+    error_dates = [_error_date(error) for error in errors]
+    first_error = date.min if None in error_dates else min(error_dates, default=date.max)
+    later_years = [year for year in years if start_year is None or year > start_year]
+    fresh = balances_by_year(entries, [year for year in later_years if date(year, 1, 1) <= first_error])
+    snapshots = {
+        year: snapshot
+        for year, snapshot in _read_snapshots(cache_dir).items()
+        if year in keys and snapshot[0] == keys[year] and year not in later_years
+    }
+    snapshots.update({year: (keys[year], balances) for year, balances in fresh.items()})
+    _write_snapshots(cache_dir, snapshots)
+
+    return errors, start_year
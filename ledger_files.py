@@ -0,0 +1,336 @@
+import contextlib
+import glob
+import heapq
+import os
+import pickle
+import re
+import shutil
+import sys
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+from beancount import loader
+from beancount.core import amount, data
+from beancount.parser import parser, printer
+from beancount.utils.misc_utils import escape_string
+
+YEAR_FILE_RE = re.compile(r"^(\d{4})\.bean$")
+
+# The first line of a dated directive, e.g. '2026-01-01 * "Coffee"'
+DATED_LINE_RE = re.compile(r"(\d{4})-(\d\d)-(\d\d)[ \t]")
+
+# An include directive: the path, and anything after it on the line
+INCLUDE_LINE_RE = re.compile(r'^include\s+"([^"]*)"(.*)$')
+
+# Directives that apply to every entry below them until they are popped
+SCOPED_LINE_RE = re.compile(r"(pushtag|pushmeta)\b")
+
+
+def year_files(ledgers_dir):
+    """
+    Return a dict mapping each year to its ledger file (e.g. ledgers/2026.bean).
+    Files that don't follow the YYYY.bean layout are ignored.
+    """
+    files = {}
+    for path in glob.glob(os.path.join(ledgers_dir, "*.bean")):
+        match = YEAR_FILE_RE.match(os.path.basename(path))
+        if match:
+            files[int(match.group(1))] = path
+    return dict(sorted(files.items()))
+
+
+def included_files(main_file):
+    """
+    Return (year_files, other_files) for the files main_file includes directly,
+    with year files (see year_files) keyed by year.
+    """
+    _, _, options_map = parser.parse_file(main_file)
+    base_dir = os.path.dirname(os.path.abspath(main_file))
+    years = {}
+    others = []
+    for pattern in options_map["include"]:
+        for path in sorted(glob.glob(os.path.join(base_dir, pattern))):
+            match = YEAR_FILE_RE.match(os.path.basename(path))
+            if match:
+                years[int(match.group(1))] = path
+            else:
+                others.append(path)
+    return dict(sorted(years.items())), others
+
+
+def load_ledger_years(main_file, years):
+    """
+    Load the entries of main_file, but only from the year files for the given
+    years. Other included files (e.g. accounts.bean) are always loaded.
+    Returns the entries and the year files that were loaded.
+    """
+    own_entries, _, _ = parser.parse_file(main_file)
+    year_paths, other_paths = included_files(main_file)
+    selected = [path for year, path in year_paths.items() if year in years]
+    return own_entries + load_entries(other_paths + selected), selected
+
+
+def load_entries(paths):
+    """
+    Load the directives of individual ledger files, outside of main.bean.
+
+    The files are booked so elided amounts are filled in, but validation errors
+    (e.g. accounts opened in accounts.bean) are expected and ignored.
+    """
+    entries = []
+    for path in paths:
+        try:
+            file_entries, _, _ = loader.load_file(path)
+        except Exception as e:
+            print(f"Error loading {path}: {e}", file=sys.stderr)
+            continue
+        entries.extend(file_entries)
+    return entries
+
+
+def _format_meta(meta, prefix):
+    """
+    Render metadata the way EntryPrinter.write_metadata does, or return None if
+    any value isn't a plain string.
+    """
+    lines = []
+    for key, value in (meta or {}).items():
+        if key in printer.EntryPrinter.META_IGNORE or key.startswith("__"):
+            continue
+        if type(value) is not str:
+            return None
+        lines.append(f'{prefix}{key}: "{escape_string(value)}"\n')
+    return "".join(lines)
+
+
+def format_transaction(entry, dformat):
+    """
+    Render a transaction whose postings have plain amounts (no cost, price,
+    flag or metadata), byte for byte as printer.EntryPrinter would with
+    default settings. This is the shape importers produce. Returns None for
+    anything else, which is left to the stock printer.
+    """
+    meta = _format_meta(entry.meta, "  ")
+    if meta is None:
+        return None
+
+    rows = []
+    width_account = 0
+    max_before = 0
+    for posting in entry.postings:
+        if posting.cost is not None or posting.price is not None or posting.flag:
+            return None
+        if posting.meta and _format_meta(posting.meta, "") != "":
+            return None
+        units = posting.units
+        if isinstance(units, amount.Amount):
+            number, currency = units.number, units.currency
+            if not (
+                type(number) is Decimal
+                and number.is_finite()
+                and type(currency) is str
+                and "A" <= currency[:1] <= "Z"
+            ):
+                return None
+            # Right-align the numbers so the currencies line up
+            number_str = dformat.format(number, currency) + " "
+            max_before = max(max_before, len(number_str))
+            rows.append((posting.account, number_str, currency))
+        else:
+            rows.append((posting.account, None, None))
+        width_account = max(width_account, len(posting.account))
+
+    strings = []
+    if entry.payee:
+        strings.append(f'"{escape_string(entry.payee)}"')
+    if entry.narration:
+        strings.append(f'"{escape_string(entry.narration)}"')
+    elif entry.payee:
+        strings.append('""')
+    strings.extend(f"#{tag}" for tag in sorted(entry.tags or ()))
+    strings.extend(f"^{link}" for link in sorted(entry.links or ()))
+
+    lines = [f"{entry.date} {entry.flag or ''} {' '.join(strings)}\n", meta]
+    for account, number_str, currency in rows:
+        if number_str is None:
+            lines.append(f"  {account}\n")
+        else:
+            lines.append(f"  {account:{width_account}}  {number_str:>{max_before}}{currency}\n")
+    return "".join(lines)
+
+
+class EntryWriter:
+    """
+    Writes entries one at a time, laid out exactly as printer.print_entries
+    would lay out the whole list. Importer-style transactions go through
+    format_transaction rather than the much slower general printer.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.printer = printer.EntryPrinter()
+        self.previous_type = None
+        self.count = 0
+
+    def write(self, entry):
+        entry_type = type(entry)
+        if self.previous_type is None:
+            self.previous_type = entry_type
+        # Insert a newline between transactions and between blocks of directives
+        if entry_type in (data.Transaction, data.Commodity) or entry_type is not self.previous_type:
+            self.file.write("\n")
+            self.previous_type = entry_type
+        text = format_transaction(entry, self.printer.dformat) if entry_type is data.Transaction else None
+        self.file.write(self.printer(entry) if text is None else text)
+        self.count += 1
+
+
+class ScopedDirectiveError(ValueError):
+    """The ledger file uses pushtag or pushmeta, so entries can't be inserted into it safely."""
+
+
+def merge_sorted(ledger_path, entries):
+    """
+    Merge entries, already sorted by data.entry_sortkey, into the ledger file
+    in date order. Each entry goes after any existing directives on its date.
+
+    The file is streamed line by line into a temporary file next to it, which
+    then replaces it, so memory use depends only on the entries being merged
+    and an interrupted merge leaves the original untouched. Lines before the
+    first directive stay at the top; other comments and blank lines stay with
+    the directive that follows them.
+
+    Raises ScopedDirectiveError, leaving the file untouched, if it uses
+    pushtag or pushmeta, since inserted entries could fall into their scope,
+    and ValueError if a dated line has an impossible date.
+    Returns the number of entries written.
+    """
+    staged = iter(entries)
+    next_entry = next(staged, None)
+    count = 0
+
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".merge-", suffix=".bean", dir=os.path.dirname(os.path.abspath(ledger_path))
+    )
+    try:
+        with os.fdopen(fd, "w") as out, open(ledger_path) as f:
+            last_line = "\n"
+            held = []
+            seen_directive = False
+
+            def insert_before(limit):
+                nonlocal next_entry, count, last_line
+                writer = None
+                while next_entry is not None and (limit is None or next_entry.date < limit):
+                    if writer is None:
+                        if not last_line.endswith("\n"):
+                            out.write("\n")
+                        writer = EntryWriter(out)
+                    writer.write(next_entry)
+                    next_entry = next(staged, None)
+                if writer is not None:
+                    count += writer.count
+                    last_line = "\n"
+                return writer is not None
+
+            def flush(lines, after_insert):
+                nonlocal last_line
+                # Keep inserted entries visually separate from the next directive
+                if after_insert and lines and lines[0].strip():
+                    out.write("\n")
+                out.writelines(lines)
+                if lines:
+                    last_line = lines[-1]
+
+            for lineno, line in enumerate(f, 1):
+                if SCOPED_LINE_RE.match(line):
+                    raise ScopedDirectiveError(f"{ledger_path} uses {line.split()[0]}, can't insert entries safely")
+                match = DATED_LINE_RE.match(line)
+                if match is None:
+                    # Postings and metadata belong to the directive above them
+                    continues = not held and line[:1] in (" ", "\t") and line.strip()
+                    if seen_directive and not continues:
+                        held.append(line)
+                    else:
+                        out.write(line)
+                        last_line = line
+                    continue
+                seen_directive = True
+                try:
+                    line_date = date(*map(int, match.groups()))
+                except ValueError as e:
+                    raise ValueError(f"{ledger_path}:{lineno}: invalid date ({e})") from None
+                inserted = insert_before(line_date)
+                flush(held + [line], inserted)
+                held = []
+
+            flush(held, False)
+            insert_before(None)
+
+        shutil.copymode(ledger_path, tmp_path)
+        os.replace(tmp_path, ledger_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    return count
+
+
+def _spill(entries):
+    spill = tempfile.TemporaryFile()
+    try:
+        for entry in entries:
+            pickle.dump(entry, spill, pickle.HIGHEST_PROTOCOL)
+        spill.seek(0)
+    except BaseException:
+        spill.close()
+        raise
+    return spill
+
+
+def _unspill(spill):
+    while True:
+        try:
+            yield pickle.load(spill)
+        except EOFError:
+            return
+
+
+def sorted_entries(entries, chunk_size):
+    """
+    Sort a stream of entries by data.entry_sortkey while holding at most
+    chunk_size of them in memory. Chunks that arrive in order aren't sorted;
+    once there is more than one chunk, sorted chunks are spilled to temporary
+    files and merged. The files are closed however the stream ends, also if
+    it is closed before it is used up.
+    """
+    spills = []
+    try:
+        chunk = []
+        in_order = True
+        last_key = None
+        for entry in entries:
+            key = data.entry_sortkey(entry)
+            if last_key is not None and key < last_key:
+                in_order = False
+            last_key = key
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                if not in_order:
+                    chunk.sort(key=data.entry_sortkey)
+                spills.append(_spill(chunk))
+                chunk = []
+                in_order = True
+                last_key = None
+
+        if not in_order:
+            chunk.sort(key=data.entry_sortkey)
+        if not spills:
+            yield from chunk
+            return
+        runs = [_unspill(spill) for spill in spills] + [iter(chunk)]
+        yield from heapq.merge(*runs, key=data.entry_sortkey)
+    finally:
+        for spill in spills:
+            spill.close()
@@ -0,0 +1,204 @@
+import fnmatch
+import glob
+import hashlib
+import io
+import os
+import re
+from datetime import date, timedelta
+
+from beancount import loader
+from beancount.core import convert, data, inventory
+from beancount.ops import summarize
+
+import ledger_files
+
+# Lines of the generated snapshot file that record how it was made
+YEARS_LINE_RE = re.compile(r"^; years: (\d+)$", re.MULTILINE)
+INPUTS_LINE_RE = re.compile(r"^; inputs: ([0-9a-f]+)$", re.MULTILINE)
+
+# Directives that would count twice if they were both summarized and kept
+SUMMARIZED = (data.Transaction, data.Pad, data.Balance)
+
+
+def _split_years(main_file, years):
+    year_paths, other_paths = ledger_files.included_files(main_file)
+    hot = list(year_paths)[-years:] if years > 0 else []
+    cold = [path for year, path in year_paths.items() if year not in hot]
+    return year_paths, hot, cold, other_paths
+
+
+def inputs_digest(main_file, years):
+    """
+    Hash everything a snapshot of main_file depends on: the main file, the
+    files it includes other than the recent year files, and which years are
+    recent. Edits to those recent years don't change it.
+    """
+    _, hot, cold, other_paths = _split_years(main_file, years)
+    digest = hashlib.sha256(repr(hot).encode())
+    for path in [main_file, *other_paths, *cold]:
+        digest.update(path.encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def read_settings(snapshot_file):
+    """Return (years, inputs digest) recorded in a snapshot file, or None if there isn't one."""
+    try:
+        with open(snapshot_file) as f:
+            header = f.read(4096)
+    except OSError:
+        return None
+    years = YEARS_LINE_RE.search(header)
+    inputs = INPUTS_LINE_RE.search(header)
+    if years is None or inputs is None:
+        return None
+    return int(years.group(1)), inputs.group(1)
+
+
+def _recent_main(main_file, recent_file, snapshot_file, hot_paths):
+    """
+    The text of main_file with the include of the year files narrowed down to
+    the recent ones, and the snapshot included instead of the older ones.
+    """
+    main_dir = os.path.dirname(os.path.abspath(main_file))
+    recent_dir = os.path.dirname(os.path.abspath(recent_file))
+    hot_paths = {os.path.abspath(path) for path in hot_paths}
+
+    def include(path):
+        return f'include "{os.path.relpath(path, recent_dir)}"\n'
+
+    lines = []
+    with open(main_file) as f:
+        for line in f:
+            match = ledger_files.INCLUDE_LINE_RE.match(line)
+            if match is None:
+                lines.append(line)
+                continue
+            pattern = os.path.join(main_dir, match.group(1))
+            matches = [os.path.abspath(path) for path in sorted(glob.glob(pattern, recursive=True))]
+            years = [path for path in matches if ledger_files.YEAR_FILE_RE.match(os.path.basename(path))]
+            if not years:
+                lines.append(include(pattern))
+                continue
+            for path in matches:
+                if path in hot_paths or path not in years:
+                    lines.append(include(path))
+    if lines and not lines[-1].endswith("\n"):
+        lines.append("\n")
+    lines.append("\n; Balances of the earlier years\n")
+    lines.append(include(os.path.abspath(snapshot_file)))
+    return "".join(lines)
+
+
+def snapshot_entries(main_file, start_year, kept_paths):
+    """
+    Summarize everything in main_file dated before start_year into opening
+    balances (see summarize.open: income and expenses are moved to equity),
+    followed by a balance assertion for each account on January 1st.
+
+    kept_paths are the files the recent ledger still includes; Open
+    directives they already have are left out.
+    Raises ValueError if they hold transactions, pads or balance assertions
+    from before start_year, which would count twice.
+    """
+    start = date(start_year, 1, 1)
+    entries, errors, options_map = loader.load_file(main_file)
+    if errors:
+        raise ValueError(f"{main_file} has {len(errors)} errors, fix them first")
+
+    kept_paths = {os.path.abspath(path) for path in kept_paths}
+    kept_opens = set()
+    for entry in entries:
+        filename = entry.meta.get("filename") if entry.meta else None
+        if filename not in kept_paths:
+            continue
+        if isinstance(entry, data.Open):
+            kept_opens.add(entry.account)
+        elif isinstance(entry, SUMMARIZED) and entry.date < start:
+            raise ValueError(
+                f"{filename}:{entry.meta['lineno']}: {entry.date} is before {start_year} "
+                "and would count twice, move it to its year file"
+            )
+
+    summary, index = summarize.open_opt(entries, start, options_map)
+    summary = summary[:index]
+
+    balances = {}
+    used = set()
+    for entry in summary:
+        if isinstance(entry, data.Transaction):
+            for posting in entry.postings:
+                used.add(posting.account)
+                balances.setdefault(posting.account, inventory.Inventory()).add_position(posting)
+
+    last_day = start - timedelta(days=1)
+    opens = {entry.account: entry for entry in summary if isinstance(entry, data.Open)}
+    result = []
+    for account in sorted((used | set(opens)) - kept_opens):
+        meta = data.new_metadata("<snapshot>", 0)
+        result.append(opens.get(account) or data.Open(meta, last_day, account, None, None))
+    result.extend(entry for entry in summary if not isinstance(entry, data.Open))
+    for account, balance in sorted(balances.items()):
+        for position in balance.reduce(convert.get_units):
+            meta = data.new_metadata("<snapshot>", 0)
+            result.append(data.Balance(meta, start, account, position.units, None, None))
+    return sorted(result, key=data.entry_sortkey)
+
+
+def write_snapshot(main_file, recent_file, snapshot_file, years):
+    """
+    Write snapshot_file with the balances at the start of the oldest of the
+    last `years` year files, and recent_file, a copy of main_file that
+    includes only those year files and the snapshot.
+    """
+    main_dir = os.path.dirname(os.path.abspath(main_file))
+    with open(main_file) as f:
+        patterns = [match.group(1) for match in map(ledger_files.INCLUDE_LINE_RE.match, f) if match]
+    if any(fnmatch.fnmatch(os.path.abspath(snapshot_file), os.path.join(main_dir, p)) for p in patterns):
+        raise ValueError(f"{main_file} would include {snapshot_file} too, put it somewhere else")
+
+    year_paths, hot, cold, other_paths = _split_years(main_file, years)
+    if not cold:
+        raise ValueError(f"{main_file} has no more than {years} year files, nothing to summarize")
+    hot_paths = [year_paths[year] for year in hot]
+    start_year = hot[0] if hot else max(year_paths) + 1
+
+    entries = snapshot_entries(main_file, start_year, [main_file, *other_paths, *hot_paths])
+    out = io.StringIO()
+    out.write(f"; Generated by scripts/snapshot_ledger.py from {os.path.basename(main_file)}, do not edit.\n")
+    out.write(f"; Balances at the start of {start_year}, summarizing {min(year_paths)} to {start_year - 1}.\n")
+    out.write(f"; years: {years}\n")
+    out.write(f"; inputs: {inputs_digest(main_file, years)}\n")
+    out.write("\n")
+    writer = ledger_files.EntryWriter(out)
+    for entry in entries:
+        writer.write(entry)
+
+    for path, text in (
+        (snapshot_file, out.getvalue()),
+        (recent_file, _recent_main(main_file, recent_file, snapshot_file, hot_paths)),
+    ):
+        with open(path + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+    return start_year
+
+
+def refresh_snapshot(main_file, recent_file, snapshot_file, years=None, force=False):
+    """
+    Regenerate the snapshot and recent ledger if anything they depend on
+    changed (see inputs_digest). years defaults to what the snapshot was last
+    made with. Returns True if they were written.
+    """
+    settings = read_settings(snapshot_file)
+    if years is None:
+        if settings is None:
+            raise ValueError(f"{snapshot_file} doesn't exist yet, pass the number of years to keep")
+        years = settings[0]
+    fresh = settings is not None and os.path.exists(recent_file)
+    if not force and fresh and settings == (years, inputs_digest(main_file, years)):
+        return False
+    write_snapshot(main_file, recent_file, snapshot_file, years)
+    return True
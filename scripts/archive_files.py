@@ -1,15 +1,14 @@
 import argparse
 import os
-import shutil
 import sys
 
 # Ensure root directory is in python path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-import beangulp
-
 import config
 import config_utils
+from archive_plan import destination, first_date, move_to_archive
+from importers.dispatch import Dispatcher, SourceFile
 
 
 def main():
@@ -30,7 +29,7 @@ def main():
         print(f"Creating archive directory '{archive_dir}'...", file=sys.stderr)
         os.makedirs(archive_dir)
 
-    importers = config.CONFIG
+    dispatcher = Dispatcher(config.CONFIG)
 
     for root, dirs, files in os.walk(imports_dir):
         for filename in files:
@@ -43,66 +42,24 @@ def main():
 
             print(f"Processing {filename}...", file=sys.stderr)
 
-            # Identify and extract to find date
+            # Identify and probe the dates covered by the file
             try:
-                file_obj = beangulp.cache.get_file(filepath)
+                file_obj = SourceFile(filepath)
                 matched_importer = None
-                entries = []
-
-                for importer in importers:
-                    if importer.identify(file_obj):
-                        matched_importer = importer
-                        try:
-                            entries = importer.extract(file_obj)
-                        except Exception as e:
-                            print(
-                                f"  Warning: Importer matched but failed to extract: {e}",
-                                file=sys.stderr,
-                            )
-                        break
-
-                if matched_importer and entries:
-                    # Find earliest date
-                    dates = [e.date for e in entries if hasattr(e, "date")]
-                    if dates:
-                        min_date = min(dates)
-                        year = min_date.year
-                        date_str = min_date.strftime("%Y-%m-%d")
-
-                        # Construct new path
-                        year_dir = os.path.join(archive_dir, str(year))
-                        if not os.path.exists(year_dir):
-                            os.makedirs(year_dir)
-
-                        new_filename = f"{date_str}_{filename}"
-                        dest_path = os.path.join(year_dir, new_filename)
-
-                        # Handle duplicate destination
-                        if os.path.exists(dest_path):
-                            print(
-                                f"  Warning: Destination {dest_path} exists. Appending timestamp.",
-                                file=sys.stderr,
-                            )
-                            import time
-
-                            ts = int(time.time())
-                            new_filename = f"{date_str}_{ts}_{filename}"
-                            dest_path = os.path.join(year_dir, new_filename)
-
-                        print(f"  Archiving to {dest_path}", file=sys.stderr)
-                        shutil.move(filepath, dest_path)
-                    else:
-                        print(
-                            f"  No dates found in entries for {filename}. Moving to 'Unsorted'.",
-                            file=sys.stderr,
-                        )
-                        unsorted_dir = os.path.join(archive_dir, "Unsorted")
-                        os.makedirs(unsorted_dir, exist_ok=True)
-                        shutil.move(filepath, os.path.join(unsorted_dir, filename))
+                first = None
+
+                matches = dispatcher.route(file_obj)
+                if matches:
+                    matched_importer = matches[0]
+                    first = first_date(matched_importer, file_obj)
+
+                if matched_importer and first:
+                    # Name the archive after the earliest date
+                    move_to_archive(filepath, destination(archive_dir, filepath, first))
 
                 elif matched_importer:
                     print(
-                        f"  Importer matched but no entries extracted. Skipping.",
+                        f"  Importer matched but no dated entries found. Skipping.",
                         file=sys.stderr,
                     )
                 else:
@@ -0,0 +1,196 @@
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Ensure root directory is in python path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from beancount import loader
+from beancount.core import number
+from beancount.parser import printer
+
+import ledger_check
+from dedup_index import DedupIndex, FuzzyIndex
+from importers.commbank import CommBankImporter, parse_amount, parse_cents, parse_date
+from ledger_files import EntryWriter
+from scripts.ingest import unique_entries
+
+
+class _MemoryFile:
+    def __init__(self, name, content):
+        self.name = name
+        self.content = content
+
+
+class _MemoryImporter(CommBankImporter):
+    def _open_file(self, file):
+        return io.StringIO(file.content)
+
+
+def generate_rows(count, seed=0):
+    """Generate a newest-first CommBank-style CSV with a few rows per day."""
+    rng = random.Random(seed)
+    merchants = ["Woolworths Metro", "Coles Express", "Netflix.com", "Uber Trip", "Local Cafe"]
+    day = date(2026, 1, 1)
+    balance = 100000
+    rows = []
+    for i in range(count):
+        if i % 4 == 0:
+            day -= timedelta(days=1)
+        cents = rng.randint(-20000, 5000)
+        rows.append(
+            f"{day:%d/%m/%Y},{cents / 100:.2f},{rng.choice(merchants)} {i % 97},{balance / 100:.2f}\n"
+        )
+        # The next (older) row's balance is from before this transaction
+        balance -= cents
+    return "".join(rows)
+
+
+def _rate(count, seconds, unit="rows"):
+    return f"{count / seconds:12,.0f} {unit}/sec"
+
+
+def bench_importer(args):
+    content = generate_rows(args.rows)
+    fields = [line.split(",") for line in content.splitlines()]
+    print(f"CommBank importer, {args.rows:,} rows")
+
+    start = time.perf_counter()
+    for row in fields:
+        datetime.strptime(row[0], "%d/%m/%Y").date()
+        number.D(row[1])
+        number.D(row[3])
+    baseline = time.perf_counter() - start
+    print(f"  parse fields (strptime + number.D):     {_rate(args.rows, baseline)}")
+
+    parse_date.cache_clear()
+    start = time.perf_counter()
+    for row in fields:
+        parse_date(row[0])
+        parse_amount(row[1])
+        parse_amount(row[3])
+    fast = time.perf_counter() - start
+    print(f"  parse fields (parse_date/parse_amount): {_rate(args.rows, fast)}")
+    print(f"  speedup: {baseline / fast:.1f}x")
+
+    parse_date.cache_clear()
+    start = time.perf_counter()
+    for row in fields:
+        parse_date(row[0])
+        parse_cents(row[1])
+        parse_cents(row[3])
+    cents = time.perf_counter() - start
+    print(f"  parse fields (parse_date/parse_cents):  {_rate(args.rows, cents)}")
+
+    importer = _MemoryImporter("Assets:Checking")
+    file = _MemoryFile("checking.csv", content)
+    start = time.perf_counter()
+    entries = importer.extract(file)
+    print(f"  full extract():                         {_rate(args.rows, time.perf_counter() - start)}")
+
+    # A re-downloaded statement where 90% of the rows are already in the ledger
+    index = DedupIndex(entries[: len(entries) * 9 // 10])
+    start = time.perf_counter()
+    for entry in importer.iter_extract(file):
+        index.is_duplicate(entry)
+    print(f"  dedup built transactions:               {_rate(args.rows, time.perf_counter() - start)}")
+    start = time.perf_counter()
+    for _ in unique_entries(importer, importer.iter_rows(file), index):
+        pass
+    print(f"  dedup rows, build survivors:            {_rate(args.rows, time.perf_counter() - start)}")
+
+    # Fuzzy matching of the survivors within a week, against the same ledger
+    fuzzy = FuzzyIndex(7, 0.5, entries[: len(entries) * 9 // 10])
+    start = time.perf_counter()
+    for _ in fuzzy.flag(entries):
+        pass
+    print(f"  fuzzy match, 7 day window:              {_rate(len(entries), time.perf_counter() - start, 'entries')}")
+
+
+def bench_printer(args):
+    content = generate_rows(args.entries)
+    entries = _MemoryImporter("Assets:Joint:Checking").extract(_MemoryFile("checking.csv", content))
+    print(f"Writing {len(entries):,} importer entries")
+
+    start = time.perf_counter()
+    expected = io.StringIO()
+    printer.print_entries(entries, file=expected)
+    baseline = time.perf_counter() - start
+    print(f"  printer.print_entries: {_rate(len(entries), baseline, 'entries')}")
+
+    start = time.perf_counter()
+    out = io.StringIO()
+    writer = EntryWriter(out)
+    for entry in entries:
+        writer.write(entry)
+    fast = time.perf_counter() - start
+    print(f"  EntryWriter:           {_rate(len(entries), fast, 'entries')}")
+    print(f"  speedup: {baseline / fast:.1f}x, identical output: {out.getvalue() == expected.getvalue()}")
+
+
+def bench_check(args):
+    years = range(2027 - args.years, 2027)
+    print(f"Checking a ledger of {args.years} years, {args.entries:,} transactions each")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ledgers_dir = os.path.join(tmp_dir, "ledgers")
+        os.makedirs(ledgers_dir)
+        main_file = os.path.join(tmp_dir, "main.bean")
+        with open(main_file, "w") as f:
+            f.write('option "operating_currency" "AUD"\ninclude "ledgers/*.bean"\n')
+            f.write(f"{years[0]}-01-01 open Assets:Checking\n{years[0]}-01-01 open Expenses:Food\n")
+        for year in years:
+            with open(os.path.join(ledgers_dir, f"{year}.bean"), "w") as f:
+                for i in range(args.entries):
+                    day = date(year, 1, 1) + timedelta(days=i * 365 // args.entries)
+                    f.write(f'{day} * "Purchase {i}"\n  Assets:Checking  -{i % 5000 / 100:.2f} AUD\n  Expenses:Food\n\n')
+        cache_dir = os.path.join(tmp_dir, "cache")
+        current_year = os.path.join(ledgers_dir, f"{years[-1]}.bean")
+
+        def timed(label, func):
+            start = time.perf_counter()
+            func()
+            print(f"  {label:<36} {time.perf_counter() - start:8.2f}s")
+
+        timed("loader.load_file (bean-check):", lambda: loader.load_file(main_file))
+        timed("ledger_check, cold cache:", lambda: ledger_check.check(main_file, cache_dir))
+        timed("ledger_check, nothing changed:", lambda: ledger_check.check(main_file, cache_dir))
+        with open(current_year, "a") as f:
+            f.write(f'{years[-1]}-12-31 * "Edit"\n  Assets:Checking  -1.00 AUD\n  Expenses:Food\n')
+        timed("ledger_check, current year edited:", lambda: ledger_check.check(main_file, cache_dir))
+        timed("ledger_check --full, warm cache:", lambda: ledger_check.check(main_file, cache_dir, full=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the import pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark", help="Benchmark to run (default: all of them)")
+
+    importer_parser = subparsers.add_parser("importer", help="CommBank row parsing")
+    importer_parser.add_argument("--rows", type=int, default=200000, help="Number of CSV rows")
+    importer_parser.set_defaults(func=bench_importer)
+
+    printer_parser = subparsers.add_parser("printer", help="Writing importer entries to a ledger")
+    printer_parser.add_argument("--entries", type=int, default=100000, help="Number of transactions")
+    printer_parser.set_defaults(func=bench_printer)
+
+    check_parser = subparsers.add_parser("check", help="Validating a multi-year ledger")
+    check_parser.add_argument("--years", type=int, default=10, help="Number of year files")
+    check_parser.add_argument("--entries", type=int, default=20000, help="Transactions per year")
+    check_parser.set_defaults(func=bench_check)
+
+    args = parser.parse_args()
+    if args.benchmark is not None:
+        args.func(args)
+        return
+    for name, subparser in subparsers.choices.items():
+        print(f"== {name} ==")
+        defaults = subparser.parse_args([])
+        defaults.func(defaults)
+
+
+if __name__ == "__main__":
+    main()
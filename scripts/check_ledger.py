@@ -1,19 +1,66 @@
+import argparse
 import os
-import sys
 import subprocess
+import sys
+import time
 
 # Ensure root directory is in python path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
+from beancount.parser import printer
+
 import config_utils
+import ledger_check
+import ledger_snapshot
+
 
 def main():
-    ledger_file = config_utils.get_main_file()
-    print(f"Checking {ledger_file}...", file=sys.stderr)
+    parser = argparse.ArgumentParser(description="Validate the ledger")
+    parser.add_argument("ledger_file", nargs="?", default=config_utils.get_main_file(), help="Main ledger file")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-validate every year instead of starting from the last unchanged year",
+    )
+    parser.add_argument("--cache-dir", help="Where to keep parsed files and year-end balances (default: check/ in the cache directory)")
+    parser.add_argument(
+        "--recent",
+        action="store_true",
+        help="Check the recent-years ledger written by snapshot_ledger.py, regenerating it if needed",
+    )
+    parser.add_argument("--bean-check", action="store_true", help="Run the stock bean-check command instead")
+
+    args = parser.parse_args()
+    ledger_file = args.ledger_file
+
+    if args.recent:
+        recent_file, snapshot_file = config_utils.get_recent_file(), config_utils.get_snapshot_file()
+        try:
+            ledger_snapshot.refresh_snapshot(ledger_file, recent_file, snapshot_file)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        ledger_file = recent_file
+
+    if args.bean_check:
+        print(f"Checking {ledger_file}...", file=sys.stderr)
+        result = subprocess.run(["bean-check", ledger_file], check=False)
+        sys.exit(result.returncode)
+
+    if not os.path.exists(ledger_file):
+        print(f"Error: Ledger file '{ledger_file}' not found.", file=sys.stderr)
+        sys.exit(1)
+
+    start = time.perf_counter()
+    cache_dir = args.cache_dir or config_utils.get_check_cache_dir()
+    errors, start_year = ledger_check.check(ledger_file, cache_dir, full=args.full)
+    scope = "every year" if start_year is None else f"from {start_year}, earlier years unchanged"
+    print(f"Checked {ledger_file} ({scope}) in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+    if errors:
+        printer.print_errors(errors, file=sys.stderr)
+        sys.exit(1)
 
-    # We delegate to the standard bean-check command
-    result = subprocess.run(["bean-check", ledger_file])
-    sys.exit(result.returncode)
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,26 @@
 import argparse
+import concurrent.futures
+import contextlib
 import os
 import sys
+import time
+from datetime import date, timedelta
 
 # Ensure root directory is in python path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-import beangulp
 from beancount import loader
 from beancount.core import data
-from beancount.parser import printer
 
 import config
 import config_utils
+import ledger_files
+from archive_plan import ArchivePlan, first_date
+from dedup_index import BatchIndex, DedupIndex, FuzzyIndex
+from file_watcher import FileWatcher, find_files
+from fingerprints import FingerprintStore, posting_keys
+from import_cache import ImportCache
+from importers.dispatch import Dispatcher, SourceFile
 
 
 def are_similar(entry1, entry2):
@@ -43,6 +52,471 @@ def are_similar(entry1, entry2):
     return match_found
 
 
+def iter_entries(importer, file_obj):
+    """
+    Stream entries from importers that support it, otherwise fall back to
+    extract(). Importers with iter_rows yield compact rows instead of
+    transactions (see unique_entries).
+    """
+    if hasattr(importer, "iter_rows"):
+        return importer.iter_rows(file_obj)
+    if hasattr(importer, "iter_extract"):
+        return importer.iter_extract(file_obj)
+    return iter(importer.extract(file_obj))
+
+
+def unique_entries(importer, items, dedup_index, batch=None):
+    """
+    Drop the entries of a stream that are already in dedup_index, or (with a
+    BatchIndex) were taken from another file in this run. Rows from iter_rows
+    are checked by their keys and only the new ones are built into
+    Transactions.
+    """
+    for item in items:
+        if isinstance(item, data.ALL_DIRECTIVES):
+            if not isinstance(item, data.Transaction):
+                yield item
+                continue
+            keys = tuple(posting_keys(item))
+        else:
+            keys = importer.row_keys(item)
+        if dedup_index.has_any(keys):
+            continue
+        source = batch.duplicate_of(keys) if batch is not None else None
+        if source is None:
+            yield item if isinstance(item, data.ALL_DIRECTIVES) else importer.build_entry(item)
+            continue
+        date, narration = keys[0][:2]
+        print(
+            f'; Skipping {date} "{narration}" from {os.path.basename(batch.current)},'
+            f" already taken from {os.path.basename(source)}",
+            file=sys.stderr,
+        )
+
+
+def identify_and_extract(filepath, dispatcher, cache=None, dates=None):
+    """
+    Yield (importer, entries) for every importer that identifies the file. The
+    file is read once and the same buffer is passed to every importer.
+
+    With a cache, unchanged files are replayed from it and everything else is
+    recorded into it as it is extracted.
+
+    With a dates dict, the date the file is archived under (see
+    archive_plan.first_date) is stored in it, from the same buffer.
+    """
+    source = SourceFile(filepath)
+    if cache is not None:
+        needs = ("first_date",) if dates is not None else ()
+        record = cache.lookup(filepath, source.digest(), needs)
+        if record is not None:
+            if dates is not None:
+                dates[filepath] = _parse_date(record["first_date"])
+            yield from _replay_cached(filepath, record, cache, dispatcher.importers)
+            return
+        recorder = cache.recorder(filepath, source.digest())
+        positions = {id(importer): index for index, importer in enumerate(dispatcher.importers)}
+        if dates is not None:
+            # Files no importer identifies aren't archived
+            recorder.extra["first_date"] = None
+
+    for position, importer in enumerate(dispatcher.route(source)):
+        if dates is not None and position == 0:
+            dates[filepath] = first_date(importer, source)
+            if cache is not None:
+                recorder.extra["first_date"] = _format_date(dates[filepath])
+        entries = iter_entries(importer, source)
+        if cache is not None:
+            entries = recorder.record(positions[id(importer)], importer, entries)
+        yield importer, entries
+
+    if cache is not None:
+        recorder.commit()
+
+
+def _parse_date(text):
+    return date.fromisoformat(text) if text else None
+
+
+def _format_date(value):
+    return value.isoformat() if value else None
+
+
+def _replay_cached(filepath, record, cache, importers):
+    print(f"; {filepath} is unchanged, reusing cached entries", file=sys.stderr)
+    yield from cache.replay(record, importers)
+
+
+def cache_dependencies(importers):
+    """Files whose changes invalidate the ingest cache."""
+    modules = {"config", "category_map"} | {type(importer).__module__ for importer in importers}
+    paths = [os.path.abspath(config_utils.get_rules_file())]
+    for name in sorted(modules):
+        module = sys.modules.get(name)
+        if getattr(module, "__file__", None):
+            paths.append(module.__file__)
+    return paths
+
+
+# Dispatcher of a worker process, set up once by _init_worker
+_worker_dispatcher = None
+
+
+def _init_worker(importers):
+    global _worker_dispatcher
+    _worker_dispatcher = Dispatcher(importers)
+
+
+def _collect(imports):
+    """
+    Read everything a file's (importer, entries) pairs yield into memory.
+    Returns a list of (importer, entries) and the error message, if any;
+    entries is None for an importer that failed while extracting.
+    """
+    collected = []
+    try:
+        for importer, entries in imports:
+            extracted = None
+            try:
+                extracted = list(entries)
+            finally:
+                # Recorded even if extracting fails, so the failure still reports the importer
+                collected.append((importer, extracted))
+    except Exception as e:
+        return collected, str(e)
+    return collected, None
+
+
+def _extract_in_worker(filepath, with_dates):
+    """
+    Run identify and extract for one file in a worker process. Returns the
+    file, a list of (importer index, entries) as _collect makes them, the
+    error message, if any, and the dates identify_and_extract found (None
+    unless with_dates, or if the file failed).
+    """
+    positions = {id(importer): index for index, importer in enumerate(_worker_dispatcher.importers)}
+    dates = {} if with_dates else None
+    collected, error = _collect(identify_and_extract(filepath, _worker_dispatcher, dates=dates))
+    imported = [(positions[id(importer)], entries) for importer, entries in collected]
+    if error is not None:
+        # A file that failed isn't archived
+        return filepath, imported, error, None
+    return filepath, imported, None, dates
+
+
+def _replay(collected, error):
+    """Turn what _collect read back into what identify_and_extract yields."""
+    for importer, entries in collected:
+        if entries is None:
+            yield importer, _raise(error)
+        else:
+            yield importer, iter(entries)
+    if error is not None:
+        raise RuntimeError(error)
+
+
+def _raise(error):
+    raise RuntimeError(error)
+    yield
+
+
+def extract_all(filepaths, importers, jobs, cache=None, dates=None):
+    """
+    Yield (filepath, imports) for each file in order, where imports yields
+    (importer, entries). With more than one job, files are identified and
+    extracted in a process pool, but results still come back in input order.
+    A file's archive date is in dates (if given) once its imports are read,
+    or never if they fail; import_files only plans files that were written.
+    """
+    if jobs == 1:
+        dispatcher = Dispatcher(importers)
+        for filepath in filepaths:
+            yield filepath, identify_and_extract(filepath, dispatcher, cache, dates)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(importers,)
+    ) as executor:
+        # Cached files are replayed in the parent, the rest go to the workers
+        pending = []
+        needs = ("first_date",) if dates is not None else ()
+        for filepath in filepaths:
+            digest = record = future = None
+            if cache is not None:
+                digest = SourceFile(filepath).digest()
+                record = cache.lookup(filepath, digest, needs)
+            if record is None:
+                future = executor.submit(_extract_in_worker, filepath, dates is not None)
+            pending.append((filepath, digest, record, future))
+
+        for filepath, digest, record, future in pending:
+            if record is not None:
+                if dates is not None:
+                    dates[filepath] = _parse_date(record["first_date"])
+                yield filepath, _replay_cached(filepath, record, cache, importers)
+                continue
+
+            filepath, imported, error, found = future.result()
+            if found is not None:
+                dates.update(found)
+            if cache is not None and error is None:
+                recorder = cache.recorder(filepath, digest)
+                if found is not None:
+                    recorder.extra["first_date"] = _format_date(found.get(filepath))
+                for index, entries in imported:
+                    for _ in recorder.record(index, importers[index], entries):
+                        pass
+                recorder.commit()
+            yield filepath, _replay([(importers[index], entries) for index, entries in imported], error)
+
+
+def read_imports(filepaths, importers, jobs, cache=None, found=None):
+    """
+    Identify and extract every file ahead of de-duplication, so the ledger
+    years to load can be taken from the entries. Returns a list of
+    (filepath, collected, error) as _collect makes them; archive dates go
+    into found, as with extract_all.
+    """
+    return [
+        (filepath, *_collect(imports))
+        for filepath, imports in extract_all(filepaths, importers, jobs, cache, found)
+    ]
+
+
+def import_years(extracted, margin_days):
+    """
+    Return the set of years touched by the entries read_imports extracted,
+    widened by margin_days on each side.
+    """
+    margin = timedelta(days=margin_days)
+    years = set()
+    for _, collected, _ in extracted:
+        for importer, entries in collected:
+            for item in entries or ():
+                if isinstance(item, data.ALL_DIRECTIVES):
+                    day = item.date
+                else:
+                    # A compact row from iter_rows (see unique_entries)
+                    day = importer.row_keys(item)[0][0]
+                years.update(((day - margin).year, (day + margin).year))
+    return years
+
+
+def load_existing_entries(args, extracted=None):
+    """
+    Load the ledger entries new ones need to be checked against: only the
+    year files overlapping the entries read ahead of time, if they were
+    (see read_imports), otherwise the whole ledger.
+    """
+    years = None
+    if extracted is not None:
+        years = import_years(extracted, max(args.margin_days, args.fuzzy_days or 0))
+
+    try:
+        if years is None:
+            print(f"; Loading existing entries from {args.ledger}...", file=sys.stderr)
+            existing_entries, errors, options = loader.load_file(args.ledger)
+        else:
+            existing_entries, loaded = ledger_files.load_ledger_years(args.ledger, years)
+            names = ", ".join(os.path.basename(path) for path in loaded) or "no year files"
+            print(f"; Loading existing entries from {args.ledger} ({names})...", file=sys.stderr)
+    except Exception as e:
+        print(f"Error loading ledger: {e}", file=sys.stderr)
+        existing_entries = []
+    return existing_entries
+
+
+def open_fingerprint_store(args):
+    """The fingerprint store, if there is one in sync with the ledger, otherwise None."""
+    if args.no_fingerprints or not os.path.exists(args.fingerprints):
+        return None
+    store = FingerprintStore(args.fingerprints)
+    if store.is_stale():
+        store.close()
+        print(
+            f"; Fingerprint store {args.fingerprints} is out of date "
+            "(run `mise run reindex`), loading the ledger instead",
+            file=sys.stderr,
+        )
+        return None
+    print(f"; Using fingerprint store {args.fingerprints}", file=sys.stderr)
+    return store
+
+
+def needs_ledger(store, fuzzy=None):
+    """
+    Whether the ledger has to be loaded: without a fingerprint store, and for
+    a FuzzyIndex, which needs the narrations the store doesn't keep.
+    """
+    return store is None or fuzzy is not None
+
+
+def load_dedup_index(args, store, fuzzy=None, extracted=None):
+    """
+    Get something to check new entries against: the fingerprint store if it is
+    in sync with the ledger, otherwise a DedupIndex over the loaded ledger.
+
+    A FuzzyIndex needs the narrations the store doesn't keep, so with one the
+    ledger is loaded into it either way.
+    """
+    if not needs_ledger(store, fuzzy):
+        return store
+
+    existing_entries = load_existing_entries(args, extracted)
+    if fuzzy is not None:
+        fuzzy.update(existing_entries)
+    if store is not None:
+        return store
+
+    # Index existing transactions once so each new entry is checked in constant time
+    return DedupIndex(existing_entries)
+
+
+def apply_watermarks(store, importers, enabled=True):
+    """
+    Give importers that support it the watermark of their account, so rows
+    already in the ledger are skipped while reading. Watermarks are only
+    trusted with a fingerprint store that is in sync with the ledger (see
+    open_fingerprint_store). Returns the watermarks applied, as
+    {account: (date, balance)}.
+    """
+    marks = store.watermarks() if enabled and store is not None else {}
+    applied = {}
+    for importer in importers:
+        if not hasattr(importer, "watermark"):
+            continue
+        mark = marks.get(importer.account)
+        if mark is None or mark[2] != getattr(importer, "currency", None):
+            importer.watermark = None
+            continue
+        importer.watermark = applied[importer.account] = mark[:2]
+        print(
+            f"; Skipping {importer.account} rows up to {mark[0]} (closing balance {mark[1]} {mark[2]})",
+            file=sys.stderr,
+        )
+    return applied
+
+
+def clear_watermarks(importers):
+    """Undo apply_watermarks, for other users of the same importers."""
+    for importer in importers:
+        if hasattr(importer, "watermark"):
+            importer.watermark = None
+
+
+def import_files(
+    filepaths, importers, args, dedup_index, writer, batch, fuzzy=None, cache=None, dates=None, extracted=None, found=None
+):
+    """
+    Extract each file, drop the entries already seen and write the rest.
+    With a dates dict, the archive date of every file whose entries were all
+    written is stored in it; files that failed are left out (or map to None,
+    if they had a date, so save_archive_plan drops them).
+
+    Files read_imports already extracted are passed as what it returned, with
+    the dates it found, and aren't read again.
+    """
+    if extracted is None:
+        found = {} if dates is not None else None
+        results = extract_all(filepaths, importers, args.jobs, cache, found)
+    else:
+        results = ((filepath, _replay(collected, error)) for filepath, collected, error in extracted)
+    for filepath, imports in results:
+        batch.start(filepath)
+        if fuzzy is not None:
+            fuzzy.start()
+        try:
+            matched = False
+            for importer, new_entries in imports:
+                print(
+                    f"**** Importing {filepath} using {importer.__class__.__name__} ****",
+                    file=sys.stderr,
+                )
+                # Checked here rather than while extracting, so cached and
+                # parallel runs report the same problems
+                if hasattr(importer, "check_balances"):
+                    new_entries = importer.check_balances(new_entries)
+
+                # Restore chronological order; nothing is written until the
+                # whole file has been read, so a failing file writes nothing
+                new_entries = unique_entries(importer, new_entries, dedup_index, batch)
+                if fuzzy is not None:
+                    new_entries = fuzzy.flag(new_entries)
+                with contextlib.closing(ledger_files.sorted_entries(new_entries, args.chunk_size)) as ordered:
+                    for entry in ordered:
+                        writer.write(entry)
+                batch.commit()
+                if fuzzy is not None:
+                    fuzzy.commit()
+                matched = True
+
+            if not matched:
+                print(f"Skipping {filepath} (no importer matched)", file=sys.stderr)
+            elif found is not None and filepath in found:
+                dates[filepath] = found.pop(filepath)
+
+        except Exception as e:
+            print(f"Error processing {filepath}: {e}", file=sys.stderr)
+            if found is not None and found.pop(filepath, None) is not None:
+                # Taken out of a plan it was in from an earlier batch
+                dates[filepath] = None
+
+
+def save_archive_plan(args, dates, fresh=True):
+    """
+    Record where the files just imported go in the archive, for
+    `merge_ledger.py --archive`. A fresh plan replaces the previous one, as
+    the staging file was rewritten; otherwise the files are added to it.
+    """
+    path = config_utils.get_archive_plan_file(args.output)
+    plan = ArchivePlan(path) if fresh else ArchivePlan.load(path)
+    for filepath, first in dates.items():
+        plan.add(filepath, args.archive_dir, first)
+    plan.save()
+    if dates:
+        print(f"; Recorded archive destinations of {len(plan.files)} files in {path}", file=sys.stderr)
+
+
+def watch(watcher, args, importers, dedup_index, batch, fuzzy=None, cache=None):
+    """
+    Import files as they land in the imports directory until interrupted,
+    appending their new entries to the output. The index, importers and
+    rules stay loaded between files.
+    """
+    print(f"; Watching {watcher.directory} for new files (Ctrl-C to stop)", file=sys.stderr)
+    total = 0
+    try:
+        while True:
+            filepaths = watcher.poll(time.time())
+            if filepaths:
+                dates = {} if args.plan_archive and args.output else None
+                # Reopened each time: accepting the staged entries empties the file
+                with open(args.output, "a") if args.output else contextlib.nullcontext(sys.stdout) as f:
+                    writer = ledger_files.EntryWriter(f)
+                    import_files(filepaths, importers, args, dedup_index, writer, batch, fuzzy, cache, dates)
+                if cache is not None:
+                    cache.save()
+                if dates is not None:
+                    # Accepting may have archived the earlier files in the meantime
+                    save_archive_plan(args, dates, fresh=False)
+                total += writer.count
+                print(
+                    f"Appended {writer.count} entries to {args.output or 'stdout'} ({total} while watching)",
+                    file=sys.stderr,
+                )
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        print("; Stopped watching", file=sys.stderr)
+
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(description="Ingest Beancount CSVs")
     parser.add_argument(
@@ -55,11 +529,99 @@ def main():
     parser.add_argument(
         "--ledger", default=config_utils.get_main_file(), help="Path to main ledger file"
     )
+    parser.add_argument(
+        "--fingerprints",
+        default=config_utils.get_fingerprint_file(),
+        help="Fingerprint store written by merge_ledger.py, used instead of loading the ledger",
+    )
+    parser.add_argument(
+        "--no-fingerprints",
+        action="store_true",
+        help="Always de-duplicate against the full ledger",
+    )
+    parser.add_argument(
+        "--no-watermarks",
+        action="store_true",
+        help="Read every statement row, even those older than what was last merged",
+    )
+    parser.add_argument(
+        "--full-ledger",
+        action="store_true",
+        help="Load every year of the ledger, not just those the imported files cover",
+    )
+    parser.add_argument(
+        "--margin-days",
+        type=int,
+        default=7,
+        help="Also load a neighbouring year file if the imports come within this many days of it",
+    )
+    parser.add_argument(
+        "--fuzzy-days",
+        type=int,
+        help="Also flag transactions for review if a ledger transaction with the same amount "
+        "and a similar description is within this many days",
+    )
+    parser.add_argument(
+        "--fuzzy-threshold",
+        type=float,
+        default=0.5,
+        help="How similar descriptions must be for --fuzzy-days, from 0 to 1 (share of words in common)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=50000,
+        help="Entries per file held in memory while sorting; larger files are sorted on disk",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="Number of files to identify and extract in parallel",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Where to cache extracted entries of unchanged files (default: next to the output)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Extract every file again, ignoring and not updating the cache",
+    )
+
+    parser.add_argument(
+        "--plan-archive",
+        action="store_true",
+        help="Also record where each imported file goes in the archive, "
+        "so `merge_ledger.py --archive` can move them without reading them again",
+    )
+    parser.add_argument(
+        "--archive-dir",
+        default=config_utils.get_archive_dir(),
+        help="Root directory for archives, for --plan-archive",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and import files as they appear in the imports directory, "
+        "appending to the output (changes to the rules need a restart)",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between scans of the imports directory with --watch",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=5.0,
+        help="Seconds a file must go unmodified before --watch imports it",
+    )
 
     args = parser.parse_args()
 
     ingest_dir = args.imports_dir
-    ledger_file = args.ledger
 
     # Resolve paths relative to CWD if necessary, but scripts are usually run from root
     if not os.path.exists(ingest_dir):
@@ -69,75 +631,79 @@ def main():
     # Get the importers from config.py
     importers = config.CONFIG
 
-    # Load existing entries for de-duplication
-    print(f"; Loading existing entries from {ledger_file}...", file=sys.stderr)
+    # Walk through the directory
+    watcher = None
+    if args.watch:
+        watcher = FileWatcher(ingest_dir, args.settle)
+        # Files still being written are left for the watcher to pick up
+        filepaths = watcher.poll(time.time())
+    else:
+        filepaths = list(find_files(ingest_dir))
+
+    fuzzy = None
+    if args.fuzzy_days is not None:
+        fuzzy = FuzzyIndex(args.fuzzy_days, args.fuzzy_threshold)
+    store = open_fingerprint_store(args)
+    # Watermarks are set on the shared importer objects, so cleared again however the run ends
     try:
-        existing_entries, errors, options = loader.load_file(ledger_file)
-    except Exception as e:
-        print(f"Error loading ledger: {e}", file=sys.stderr)
-        existing_entries = []
+        watermarks = apply_watermarks(store, importers, not args.no_watermarks)
 
-    # Filter existing entries to only Transactions for efficiency
-    existing_txns = [e for e in existing_entries if isinstance(e, data.Transaction)]
+        cache = None
+        if args.output and not args.no_cache:
+            cache_dir = args.cache_dir or config_utils.get_ingest_cache_dir(args.output)
+            # Rows skipped under one watermark may be needed under another
+            cache = ImportCache(cache_dir, cache_dependencies(importers), repr(sorted(watermarks.items())))
 
-    # Process files
-    entries = []
+        batch = BatchIndex()
+        dates = {} if args.plan_archive and args.output else None
+        extracted = None
+        found = {} if dates is not None else None
+        # The files are read first, so only the ledger years they cover are loaded.
+        # A watcher can't know which years later files will cover.
+        if needs_ledger(store, fuzzy) and not (args.full_ledger or args.watch):
+            extracted = read_imports(filepaths, importers, args.jobs, cache, found)
+        dedup_index = load_dedup_index(args, store, fuzzy, extracted)
+        # Entries are de-duplicated and written to the output as they are extracted,
+        # or replayed from memory if they were read ahead
+        if args.output:
+            # Ensure directory exists
+            output_dir = os.path.dirname(os.path.abspath(args.output))
+            os.makedirs(output_dir, exist_ok=True)
+            # Written to a temporary file and swapped in at the end, so a run that
+            # fails leaves the staging file as it was
+            tmp_path = args.output + ".tmp"
+            try:
+                with open(tmp_path, "w") as output:
+                    writer = ledger_files.EntryWriter(output)
+                    import_files(
+                        filepaths, importers, args, dedup_index, writer, batch, fuzzy, cache, dates, extracted, found
+                    )
+                os.replace(tmp_path, args.output)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(tmp_path)
+                raise
+        else:
+            writer = ledger_files.EntryWriter(sys.stdout)
+            import_files(filepaths, importers, args, dedup_index, writer, batch, fuzzy, cache, dates, extracted, found)
 
-    # Walk through the directory
-    for root, dirs, files in os.walk(ingest_dir):
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            filepath = os.path.abspath(filepath)
+        if cache is not None:
+            cache.save()
+        if args.output:
+            # Without --plan-archive this just drops a plan for the old staging file
+            save_archive_plan(args, dates or {})
 
-            # Skip hidden files
-            if filename.startswith("."):
-                continue
+        # Output
+        if args.output:
+            print(
+                f"Successfully wrote {writer.count} entries to {args.output}",
+                file=sys.stderr,
+            )
 
-            # Create a cache object for the file (required by beangulp)
-            try:
-                matched = False
-                for importer in importers:
-                    file_obj = beangulp.cache.get_file(filepath)
-
-                    if importer.identify(file_obj):
-                        print(
-                            f"**** Importing {filepath} using {importer.__class__.__name__} ****",
-                            file=sys.stderr,
-                        )
-                        new_entries = importer.extract(file_obj)
-
-                        unique_entries = []
-                        for new_entry in new_entries:
-                            is_dup = False
-                            for existing in existing_txns:
-                                if are_similar(new_entry, existing):
-                                    is_dup = True
-                                    break
-
-                            if not is_dup:
-                                unique_entries.append(new_entry)
-
-                        entries.extend(unique_entries)
-                        matched = True
-
-                if not matched:
-                    print(f"Skipping {filepath} (no importer matched)", file=sys.stderr)
-
-            except Exception as e:
-                print(f"Error processing {filepath}: {e}", file=sys.stderr)
-
-    # Output
-    if args.output:
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(args.output), exist_ok=True)
-        with open(args.output, "w") as f:
-            printer.print_entries(entries, file=f)
-        print(
-            f"Successfully wrote {len(entries)} entries to {args.output}",
-            file=sys.stderr,
-        )
-    else:
-        printer.print_entries(entries, file=sys.stdout)
+        if watcher is not None:
+            watch(watcher, args, importers, dedup_index, batch, fuzzy, cache)
+    finally:
+        clear_watermarks(importers)
 
 
 if __name__ == "__main__":
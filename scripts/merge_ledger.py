@@ -1,4 +1,5 @@
 import argparse
+import io
 import os
 import sys
 from collections import defaultdict
@@ -6,10 +7,77 @@ from collections import defaultdict
 # Ensure root directory is in python path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-import config_utils
 from beancount import loader
 from beancount.core import data
-from beancount.parser import printer
+from beancount.parser import booking, printer
+from beancount.parser import parser as beancount_parser
+
+import config_utils
+import ledger_check
+import ledger_snapshot
+from archive_plan import ArchivePlan
+from fingerprints import FingerprintStore
+from ledger_files import EntryWriter, ScopedDirectiveError, merge_sorted
+
+
+def rebuild_fingerprints(fingerprint_file, ledgers_dir):
+    print(f"Rebuilding {fingerprint_file} from {ledgers_dir}...", file=sys.stderr)
+    with FingerprintStore(fingerprint_file) as store:
+        count = store.rebuild(ledgers_dir)
+    print(f"Indexed {count} entries.", file=sys.stderr)
+
+
+def parse_staging(staging_file):
+    """
+    Read the staged directives with the raw parser only: no booking, plugins or
+    validation, so no spurious errors about accounts the staging file doesn't open.
+    Returns the entries and the parser's options.
+    """
+    entries, errors, options_map = beancount_parser.parse_file(staging_file)
+    if errors:
+        printer.print_errors(errors, file=sys.stderr)
+        print(f"Error: {staging_file} has syntax errors, nothing merged.", file=sys.stderr)
+        sys.exit(1)
+    entries.sort(key=data.entry_sortkey)
+    return entries, options_map
+
+
+def check_ledger(ledger_file, cache_dir):
+    """
+    Validate the ledger after merging, from the first year the merge touched
+    (see ledger_check.check). Returns the number of errors.
+    """
+    print(f"Checking {ledger_file}...", file=sys.stderr)
+    errors, _ = ledger_check.check(ledger_file, cache_dir)
+    if errors:
+        printer.print_errors(errors, file=sys.stderr)
+        print(f"Warning: {ledger_file} has {len(errors)} errors after merging.", file=sys.stderr)
+    return len(errors)
+
+
+def keep_unmerged(staging_file, entries, merged_years):
+    """Rewrite the staging file with just the entries of the years not merged yet."""
+    writer = EntryWriter(io.StringIO())
+    for entry in entries:
+        if entry.date.year not in merged_years:
+            writer.write(entry)
+    with open(staging_file, "w") as f:
+        f.write(writer.file.getvalue())
+    if merged_years:
+        years = ", ".join(map(str, sorted(merged_years)))
+        print(f"Merged {years} already; {staging_file} keeps the rest.", file=sys.stderr)
+
+
+def archive_imports(plan_file):
+    """Move the imported files to the archive where ingest --plan-archive said they go."""
+    if not os.path.exists(plan_file):
+        print(
+            f"Nothing to archive: {plan_file} not found (import with --plan-archive, or run `mise run archive`).",
+            file=sys.stderr,
+        )
+        return
+    moved = ArchivePlan.load(plan_file).execute()
+    print(f"Archived {moved} files.", file=sys.stderr)
 
 
 def main():
@@ -18,11 +86,46 @@ def main():
     )
     parser.add_argument("staging_file", nargs="?", default=config_utils.get_staging_file(), help="Path to the staging bean file")
     parser.add_argument("ledgers_dir", nargs="?", default=config_utils.get_ledger_dir(), help="Directory containing yearly ledger files")
+    parser.add_argument("--fingerprints", help="Fingerprint store to update (default: inside the ledgers directory)")
+    parser.add_argument(
+        "--rebuild-fingerprints",
+        action="store_true",
+        help="Regenerate the fingerprint store from the year files and exit (use after hand edits)",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Parse the staging file without booking, plugins or validation",
+    )
+    parser.add_argument(
+        "--sorted",
+        action="store_true",
+        help="Insert entries into the year files in date order instead of appending",
+    )
+    parser.add_argument("--check", action="store_true", help="Validate the main ledger after merging")
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Also archive the imported files, as recorded by ingest --plan-archive",
+    )
+    parser.add_argument(
+        "--ledger",
+        default=config_utils.get_main_file(),
+        help="Main ledger file, for --check and the recent-years snapshot",
+    )
 
     args = parser.parse_args()
 
     staging_file = args.staging_file
     ledgers_dir = args.ledgers_dir
+    fingerprint_file = args.fingerprints or config_utils.get_fingerprint_file(ledgers_dir)
+
+    if args.rebuild_fingerprints:
+        if not os.path.exists(ledgers_dir):
+            print(f"Error: Ledgers directory '{ledgers_dir}' not found.", file=sys.stderr)
+            sys.exit(1)
+        rebuild_fingerprints(fingerprint_file, ledgers_dir)
+        return
 
     if not os.path.exists(staging_file):
         print(f"Error: Staging file '{staging_file}' not found.", file=sys.stderr)
@@ -34,14 +137,19 @@ def main():
 
     # Load the staging file
     print(f"Loading entries from {staging_file}...", file=sys.stderr)
-    try:
-        entries, errors, options = loader.load_file(staging_file)
-    except Exception as e:
-        print(f"Error loading staging file: {e}", file=sys.stderr)
-        sys.exit(1)
+    if args.fast:
+        entries, options = parse_staging(staging_file)
+    else:
+        try:
+            entries, errors, options = loader.load_file(staging_file)
+        except Exception as e:
+            print(f"Error loading staging file: {e}", file=sys.stderr)
+            sys.exit(1)
 
     if not entries:
         print("No entries found in staging file.", file=sys.stderr)
+        if args.archive:
+            archive_imports(config_utils.get_archive_plan_file(staging_file))
         sys.exit(0)
 
     # Group entries by year
@@ -54,7 +162,12 @@ def main():
             # Default to current year or handle specific logic
             print(f"Warning: Entry without date found: {entry}", file=sys.stderr)
 
-    # Append to year files
+    # Check the store before touching the year files, or hand edits would go unnoticed
+    store = FingerprintStore(fingerprint_file)
+    store_was_stale = store.is_stale(ledgers_dir)
+
+    # Append to (or merge into) year files
+    merged_years = set()
     for year, year_entries in entries_by_year.items():
         ledger_path = os.path.join(ledgers_dir, f"{year}.bean")
 
@@ -64,18 +177,48 @@ def main():
             with open(ledger_path, "w") as f:
                 f.write(f"; Transactions for {year}\n\n")
 
-        print(
-            f"Appending {len(year_entries)} entries to {ledger_path}...",
-            file=sys.stderr,
-        )
-
-        # Sort entries by date before writing?
-        # Usually it's better to sort, but appending implies chronological order if import was chronological.
-        # Beancount doesn't strictly require sorted file, but it's nice.
-        # We'll just append for now to be safe and simple.
-
+        if args.sorted:
+            print(f"Merging {len(year_entries)} entries into {ledger_path}...", file=sys.stderr)
+            try:
+                merge_sorted(ledger_path, year_entries)
+                merged_years.add(year)
+                continue
+            except ScopedDirectiveError as e:
+                print(f"Warning: {e}; appending instead.", file=sys.stderr)
+            except ValueError as e:
+                # A year file that doesn't parse; appending to it would hide the problem
+                store.close()
+                keep_unmerged(staging_file, entries, merged_years)
+                print(f"Error: {e}. Fix it and accept again.", file=sys.stderr)
+                sys.exit(1)
+        else:
+            print(
+                f"Appending {len(year_entries)} entries to {ledger_path}...",
+                file=sys.stderr,
+            )
+
+        # Render the year's entries up front so the file gets a single write
+        writer = EntryWriter(io.StringIO())
+        for entry in year_entries:
+            writer.write(entry)
         with open(ledger_path, "a") as f:
-            printer.print_entries(year_entries, file=f)
+            f.write(writer.file.getvalue())
+        merged_years.add(year)
+
+    # Keep the fingerprint store in sync so ingest can skip loading the ledger
+    if store_was_stale:
+        store.close()
+        rebuild_fingerprints(fingerprint_file, ledgers_dir)
+        store = FingerprintStore(fingerprint_file)
+    else:
+        if args.fast:
+            # Fingerprint interpolated amounts too, as a rebuild from the year files would
+            entries, _ = booking.book(entries, options)
+        store.add_entries(entries)
+        store.record_sources(ledgers_dir)
+    # Statement rows up to the merged closing balances needn't be read again
+    store.update_watermarks(entries)
+    store.close()
 
     # Clear staging file
     print(f"Clearing {staging_file}...", file=sys.stderr)
@@ -84,6 +227,21 @@ def main():
 
     print("Merge complete.", file=sys.stderr)
 
+    if args.archive:
+        archive_imports(config_utils.get_archive_plan_file(staging_file))
+
+    # Back-dated entries change the balances summarized for the recent-years ledger
+    recent_file, snapshot_file = config_utils.get_recent_file(), config_utils.get_snapshot_file(ledgers_dir)
+    if ledger_snapshot.read_settings(snapshot_file) is not None:
+        try:
+            if ledger_snapshot.refresh_snapshot(args.ledger, recent_file, snapshot_file):
+                print(f"Regenerated {snapshot_file} and {recent_file}", file=sys.stderr)
+        except ValueError as e:
+            print(f"Warning: could not regenerate {snapshot_file}: {e}", file=sys.stderr)
+
+    if args.check and check_ledger(args.ledger, config_utils.get_check_cache_dir(ledgers_dir)):
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -1,52 +1,216 @@
+import argparse
 import os
-import sys
+import signal
+import socket
 import subprocess
+import sys
+import time
 
 # Ensure root directory is in python path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
+from beancount.core import data, getters
+from beancount.parser import parser as beancount_parser
+
 import config_utils
+from ledger_files import INCLUDE_LINE_RE
+
+PID_FILENAME = ".fava.pid"
+
+
+def referenced_accounts(entries):
+    """Every account the entries post to or otherwise mention."""
+    accounts = set()
+    for entry in entries:
+        accounts.update(getters.get_entry_accounts(entry))
+    return accounts
+
+
+def review_ledger(staging_file, accounts_file):
+    """
+    Return the text of a review ledger for staging_file: the options, a copy
+    of accounts_file without the Open and Close directives of accounts the
+    staged entries don't use, and an include of the staging file, so edits
+    made in Fava go there. Options, plugins, commodities and everything else
+    in accounts_file are kept as written. Accounts missing from accounts_file
+    are left for Fava to report.
+    """
+    staged, _, _ = beancount_parser.parse_file(staging_file)
+    accounts = referenced_accounts(staged)
+    accounts_path = os.path.abspath(accounts_file)
+    directives, _, _ = beancount_parser.parse_file(accounts_path)
+    unused = {
+        entry.meta["lineno"]
+        for entry in directives
+        if isinstance(entry, (data.Open, data.Close))
+        and entry.account not in accounts
+        and entry.meta["filename"] == accounts_path
+    }
+
+    lines = [
+        'option "title" "Staging Review"\n',
+        'option "operating_currency" "AUD"\n',
+        "\n",
+        f"; {accounts_path}, without the accounts the staging file doesn't use\n",
+    ]
+    dropping = False
+    with open(accounts_path) as f:
+        for lineno, line in enumerate(f, 1):
+            if lineno in unused:
+                dropping = True
+                continue
+            # Metadata lines belong to the directive above them
+            if dropping and line[:1] in (" ", "\t") and line.strip():
+                continue
+            dropping = False
+            match = INCLUDE_LINE_RE.match(line)
+            if match:
+                path = os.path.join(os.path.dirname(accounts_path), match.group(1))
+                line = f'include "{path}"{match.group(2)}\n'
+            lines.append(line)
+    # Absolute path, to avoid relative include hell
+    lines.append(f'\ninclude "{os.path.abspath(staging_file)}"\n')
+    return "".join(lines)
+
+
+def write_if_changed(path, text):
+    """Write text to path unless it already holds it, so a running Fava doesn't reload for nothing."""
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    with open(path, "w") as f:
+        f.write(text)
+    return True
+
+
+def port_open(host, port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(0.2)
+        return sock.connect_ex((host, port)) == 0
+
+
+def running_fava(pid_file):
+    """
+    Return (pid, host, port) of the Fava started by an earlier review if it
+    is still up, otherwise None (and remove a stale pid file).
+    """
+    try:
+        with open(pid_file) as f:
+            pid, host, port = f.read().split()
+        pid, port = int(pid), int(port)
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        pid = None
+    if pid is not None and port_open(host, port):
+        return pid, host, port
+    if os.path.exists(pid_file):
+        os.remove(pid_file)
+    return None
+
+
+def wait_for_fava(process, host, port, timeout=60):
+    """Wait until Fava accepts connections. Returns False if it exited or timed out."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        if port_open(host, port):
+            return True
+        time.sleep(0.05)
+    return False
+
 
 def main():
-    # Gather paths from env
-    staging_file = config_utils.get_staging_file()
-    accounts_file = config_utils.get_accounts_file()
+    parser = argparse.ArgumentParser(description="Review staged transactions in Fava")
+    parser.add_argument("--host", default="127.0.0.1", help="Address for a newly started Fava to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="Port for a newly started Fava")
+    parser.add_argument(
+        "--background",
+        action="store_true",
+        help="Leave Fava running after this command returns, for later reviews to reuse",
+    )
+    parser.add_argument("--stop", action="store_true", help="Stop the Fava left running by --background")
 
-    # We need to construct a review file that includes the accounts and the staging file.
+    args = parser.parse_args()
 
+    start = time.perf_counter()
+    staging_file = config_utils.get_staging_file()
+    accounts_file = config_utils.get_accounts_file()
+    review_dir = os.path.dirname(staging_file) or "."
+    review_file = os.path.join(review_dir, "review.bean")
+    pid_file = os.path.join(review_dir, PID_FILENAME)
 
-    # The review file should ideally be in the same dir as staging file to resolve relative imports if needed,
-    # OR we use absolute paths in the include.
+    running = running_fava(pid_file)
+    if args.stop:
+        if running is None:
+            print("No review Fava is running.", file=sys.stderr)
+            return
+        os.kill(running[0], signal.SIGTERM)
+        os.remove(pid_file)
+        print(f"Stopped Fava (pid {running[0]}).", file=sys.stderr)
+        return
 
-    # Let's create a temporary review file
-    review_file = "staging/review.bean" # Default location
+    if not os.path.exists(staging_file):
+        print(f"Error: Staging file '{staging_file}' not found.", file=sys.stderr)
+        sys.exit(1)
 
     # Ensure staging dir exists
-    os.makedirs(os.path.dirname(review_file), exist_ok=True)
+    os.makedirs(review_dir, exist_ok=True)
+    changed = write_if_changed(review_file, review_ledger(staging_file, accounts_file))
+    print(
+        f"{'Generated' if changed else 'Unchanged'} review configuration at {review_file} "
+        f"({time.perf_counter() - start:.2f}s)",
+        file=sys.stderr,
+    )
 
-    # Convert to absolute paths to avoid relative include hell
-    abs_accounts = os.path.abspath(accounts_file)
-    abs_staging = os.path.abspath(staging_file)
+    # A running Fava reloads the review file and the staging file by itself
+    if running is not None:
+        print(
+            f"Reusing Fava at http://{running[1]}:{running[2]} (pid {running[0]}), "
+            f"ready in {time.perf_counter() - start:.2f}s",
+            file=sys.stderr,
+        )
+        return
 
-    content = f"""
-option "title" "Staging Review"
-option "operating_currency" "AUD"
+    # A Fava that can't bind would look ready while something else answers
+    if port_open(args.host, args.port):
+        print(f"Error: Port {args.port} is already in use, pick another with --port.", file=sys.stderr)
+        sys.exit(1)
 
-include "{abs_accounts}"
-include "{abs_staging}"
-"""
+    print("Starting Fava...", file=sys.stderr)
+    command = ["fava", "--host", args.host, "--port", str(args.port), review_file]
+    if args.background:
+        log_path = os.path.join(review_dir, "fava.log")
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    else:
+        process = subprocess.Popen(command)
 
-    with open(review_file, "w") as f:
-        f.write(content)
+    if not wait_for_fava(process, args.host, args.port):
+        process.terminate()
+        print("Error: Fava did not start.", file=sys.stderr)
+        sys.exit(1)
+    with open(pid_file, "w") as f:
+        f.write(f"{process.pid} {args.host} {args.port}\n")
+    print(
+        f"Fava ready at http://{args.host}:{args.port} (pid {process.pid}) in {time.perf_counter() - start:.2f}s",
+        file=sys.stderr,
+    )
+    if args.background:
+        print("Later reviews reuse it; `mise run review -- --stop` stops it.", file=sys.stderr)
+        return
 
-    print(f"Generated review configuration at {review_file}", file=sys.stderr)
-    print(f"Starting Fava...", file=sys.stderr)
-
-    # Run fava
     try:
-        subprocess.run(["fava", review_file])
+        process.wait()
     except KeyboardInterrupt:
-        pass
+        process.wait()
+    finally:
+        # Removes the pid file once Fava is gone
+        running_fava(pid_file)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,49 @@
+import argparse
+import os
+import sys
+
+# Ensure root directory is in python path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import config_utils
+import ledger_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarize older years into opening balances for a faster recent-years ledger"
+    )
+    parser.add_argument("ledger_file", nargs="?", default=config_utils.get_main_file(), help="Main ledger file")
+    parser.add_argument(
+        "--years",
+        type=int,
+        help="Number of recent year files to keep (default: as last time, or 2)",
+    )
+    parser.add_argument("--output", default=config_utils.get_recent_file(), help="Recent-years ledger to write")
+    parser.add_argument("--snapshot", default=config_utils.get_snapshot_file(), help="Opening balances file to write")
+    parser.add_argument("--force", action="store_true", help="Regenerate even if nothing changed")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.ledger_file):
+        print(f"Error: Ledger file '{args.ledger_file}' not found.", file=sys.stderr)
+        sys.exit(1)
+
+    years = args.years
+    if years is None and ledger_snapshot.read_settings(args.snapshot) is None:
+        years = 2
+
+    try:
+        written = ledger_snapshot.refresh_snapshot(args.ledger_file, args.output, args.snapshot, years, args.force)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if written:
+        print(f"Wrote {args.snapshot} and {args.output}", file=sys.stderr)
+    else:
+        print(f"{args.output} is up to date", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
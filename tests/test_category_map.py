@@ -0,0 +1,86 @@
+import re
+
+from category_map import RuleEngine
+
+RULES = {
+    "Woolworths|Coles": "Expenses:Groceries",
+    "Netflix|Spotify": "Expenses:Entertainment",
+    "^Uber": "Expenses:Transport",
+    r"Transfer to \d+": "Assets:Savings",
+    "Uber Eats": "Expenses:Takeaway",
+}
+
+DESCRIPTIONS = [
+    "COLES SUPERMARKET 123",
+    "Spotify at Woolworths",  # Later in the string, but the earlier rule wins
+    "Uber Eats Sydney",
+    "Payment to Uber Eats",
+    "Transfer to 123456",
+    "Transfer to savings",
+    "Unknown Vendor",
+    "",
+]
+
+
+def first_match(rules, description):
+    """The original categorization loop, for comparison."""
+    for pattern, account in rules.items():
+        if re.search(pattern, description, re.IGNORECASE):
+            return account
+    return None
+
+
+def test_rule_engine_preserves_rule_order():
+    engine = RuleEngine(RULES)
+    for description in DESCRIPTIONS:
+        rule = engine.match(description)
+        assert (rule.account if rule else None) == first_match(RULES, description), description
+
+    rule = engine.match("Spotify at Woolworths")
+    assert rule.index == 0
+    assert rule.pattern == "Woolworths|Coles"
+
+
+def test_rule_engine_fallback_for_backreferences():
+    rules = {r"(\d)\1": "Expenses:Repeated", "Coles": "Expenses:Groceries"}
+    engine = RuleEngine(rules)
+    for description in ["Coles 11", "Coles 12", "33"]:
+        rule = engine.match(description)
+        assert (rule.account if rule else None) == first_match(rules, description)
+
+
+def test_rule_engine_skips_invalid_patterns():
+    engine = RuleEngine({"Coles(": "Expenses:Broken", "Coles": "Expenses:Groceries"})
+    assert engine.match("Coles").account == "Expenses:Groceries"
+    assert RuleEngine().match("Coles") is None
+
+
+def test_literal_alternatives_detection():
+    from category_map import _literal_alternatives
+
+    assert _literal_alternatives("Woolworths|Coles") == ["woolworths", "coles"]
+    assert _literal_alternatives(r"7\-Eleven|Dan Murphy's") == ["7-eleven", "dan murphy's"]
+    assert _literal_alternatives("^Uber") is None
+    assert _literal_alternatives(r"Transfer to \d+") is None
+    assert _literal_alternatives("Coles|") is None
+    assert _literal_alternatives("Café") is None
+
+
+def test_rule_engine_literal_and_regex_priority():
+    import random
+
+    rules = {
+        "Uber Eats|Menulog": "Expenses:Takeaway",
+        "^Uber": "Expenses:Transport",
+        "Uber|Lyft": "Expenses:Rideshare",
+        r"Coles\s+Express": "Expenses:Fuel",
+        "Coles|Woolworths|Aldi": "Expenses:Groceries",
+        "Eats": "Expenses:Food",
+    }
+    engine = RuleEngine(rules)
+    words = ["Uber", "uber", "EATS", "Coles", "Express", "Lyft", "aldi", "Menu", "log", "Café", " ", "x"]
+    rng = random.Random(42)
+    for _ in range(2000):
+        description = "".join(rng.choice(words) for _ in range(rng.randint(0, 5)))
+        rule = engine.match(description)
+        assert (rule.account if rule else None) == first_match(rules, description), description
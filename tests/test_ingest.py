@@ -1,8 +1,15 @@
+import io
+import tempfile
 from datetime import date
+from unittest.mock import patch
 
+import pytest
 from beancount.core import amount, data, number
+from beancount.parser import printer
 
-from scripts.ingest import are_similar
+from dedup_index import DedupIndex
+from ledger_files import EntryWriter, sorted_entries
+from scripts.ingest import are_similar, unique_entries
 
 
 def test_deduplication_logic():
@@ -79,3 +86,217 @@ def test_deduplication_logic():
     assert are_similar(txn1, txn_balanced), (
         "Should match if at least one posting matches exactly"
     )
+
+
+def test_dedup_index_matches_are_similar():
+    """DedupIndex must give the same answers as a pairwise are_similar scan."""
+    meta = data.new_metadata("dummy", 1)
+    units = amount.Amount(number.D("100.00"), "USD")
+    units_neg = amount.Amount(number.D("-100.00"), "USD")
+    account = "Assets:Test"
+
+    def txn(txn_date, narration, postings):
+        return data.Transaction(
+            meta,
+            txn_date,
+            "*",
+            None,
+            narration,
+            data.EMPTY_SET,
+            data.EMPTY_SET,
+            [data.Posting(acc, amt, None, None, None, None) for acc, amt in postings],
+        )
+
+    existing = [
+        txn(date(2026, 1, 1), "Target Store", [(account, units), ("Expenses:General", units_neg)]),
+        txn(date(2026, 1, 3), "Walmart", [(account, units_neg)]),
+    ]
+    candidates = [
+        txn(date(2026, 1, 1), "Target Store", [(account, units)]),
+        # Same value written with a different precision is still equal
+        txn(date(2026, 1, 1), "Target Store", [(account, amount.Amount(number.D("100.0"), "USD"))]),
+        txn(date(2026, 1, 2), "Target Store", [(account, units)]),
+        txn(date(2026, 1, 1), "Walmart", [(account, units)]),
+        txn(date(2026, 1, 3), "Walmart", [("Expenses:Other", units), (account, units_neg)]),
+        txn(date(2026, 1, 3), "Walmart", [(account, units)]),
+    ]
+
+    index = DedupIndex(existing)
+    for candidate in candidates:
+        expected = any(are_similar(candidate, e) for e in existing)
+        assert index.is_duplicate(candidate) == expected, candidate
+
+    # Non-transaction directives are never duplicates
+    balance = data.Balance(meta, date(2026, 1, 1), account, units, None, None)
+    assert not index.is_duplicate(balance)
+
+
+def _sample_entries():
+    units = amount.Amount(number.D("-12.50"), "AUD")
+    entries = []
+    for i, day in enumerate([5, 3, 3, 9, 1, 7, 2, 8]):
+        meta = data.new_metadata("sample.csv", i)
+        entries.append(
+            data.Transaction(
+                meta,
+                date(2026, 1, day),
+                "*",
+                None,
+                f"Purchase {i}",
+                data.EMPTY_SET,
+                data.EMPTY_SET,
+                [
+                    data.Posting("Assets:Test", units, None, None, None, None),
+                    data.Posting("Expenses:Test", -units, None, None, None, None),
+                ],
+            )
+        )
+    for i, day in enumerate([10, 10]):
+        meta = data.new_metadata("sample.csv", 100 + i)
+        entries.append(data.Balance(meta, date(2026, 1, day), "Assets:Test", units, None, None))
+    return entries
+
+
+def test_entry_writer_matches_print_entries():
+    entries = _sample_entries()
+    expected = io.StringIO()
+    printer.print_entries(entries, file=expected)
+
+    output = io.StringIO()
+    writer = EntryWriter(output)
+    for entry in entries:
+        writer.write(entry)
+    assert output.getvalue() == expected.getvalue()
+    assert writer.count == len(entries)
+
+
+def test_sorted_entries_spills_in_chunks():
+    entries = _sample_entries()
+    expected = sorted(entries, key=data.entry_sortkey)
+    for chunk_size in (1, 3, 100):
+        assert list(sorted_entries(iter(entries), chunk_size)) == expected
+    assert list(sorted_entries(iter(expected), 3)) == expected
+    assert list(sorted_entries(iter([]), 3)) == []
+
+
+def test_sorted_entries_closes_spills_it_does_not_finish():
+    entries = _sample_entries()
+    opened = []
+    real_temporary_file = tempfile.TemporaryFile
+
+    def temporary_file():
+        spill = real_temporary_file()
+        opened.append(spill)
+        return spill
+
+    def failing():
+        yield from entries[:3]
+        raise RuntimeError("bad row")
+
+    with patch("ledger_files.tempfile.TemporaryFile", temporary_file):
+        stream = sorted_entries(iter(entries), 1)
+        next(stream)
+        stream.close()
+        with pytest.raises(RuntimeError):
+            list(sorted_entries(failing(), 1))
+
+    assert len(opened) == len(entries) + 3
+    assert all(spill.closed for spill in opened)
+
+
+def test_unique_entries_builds_only_new_rows():
+    from importers.commbank import CommBankImporter
+
+    class _Importer(CommBankImporter):
+        built = 0
+
+        def _open_file(self, file):
+            return io.StringIO(file.content)
+
+        def build_entry(self, row):
+            self.built += 1
+            return super().build_entry(row)
+
+    class _File:
+        name = "test.csv"
+        content = "01/01/2026,100.00,Deposit,1000.00\n02/01/2026,-5.00,Coffee,995.00\n"
+
+    importer = _Importer("Assets:Test")
+    existing = list(importer.iter_extract(_File()))
+    importer.built = 0
+
+    new = list(unique_entries(importer, importer.iter_rows(_File()), DedupIndex(existing[:1])))
+    assert new == existing[1:]
+    assert importer.built == 1
+
+
+def test_batch_index_counts_copies_per_file():
+    from dedup_index import BatchIndex
+
+    coffee = [(date(2026, 1, 1), "Coffee", "Assets:Test", -500, "AUD")]
+    lunch = [(date(2026, 1, 1), "Lunch", "Assets:Test", -1500, "AUD")]
+    batch = BatchIndex()
+
+    batch.start("a.csv")
+    # Two identical purchases in one file are both kept
+    assert batch.duplicate_of(coffee) is None
+    assert batch.duplicate_of(coffee) is None
+    batch.commit()
+
+    batch.start("failed.csv")
+    assert batch.duplicate_of(lunch) is None
+    # Not committed: the file failed and wrote nothing
+
+    batch.start("b.csv")
+    assert batch.duplicate_of(coffee) == "a.csv"
+    assert batch.duplicate_of(coffee) == "a.csv"
+    # A third copy wasn't in a.csv
+    assert batch.duplicate_of(coffee) is None
+    assert batch.duplicate_of(lunch) is None
+    batch.commit()
+
+    batch.start("c.csv")
+    assert batch.duplicate_of(lunch) == "b.csv"
+
+
+def test_fuzzy_index_blocks_by_amount_and_date():
+    from dedup_index import FuzzyIndex, narration_tokens
+
+    def txn(txn_date, narration, cents, account="Expenses:Groceries"):
+        units = amount.Amount(number.D(cents) / 100, "AUD")
+        return data.Transaction(
+            data.new_metadata("ledger.bean", 1), txn_date, "*", None, narration, data.EMPTY_SET, data.EMPTY_SET,
+            [data.Posting("Assets:Checking", -units, None, None, None, None),
+             data.Posting(account, units, None, None, None, None)],
+        )
+
+    assert narration_tokens("WOOLWORTHS 1234 SYDNEY Card xx4321") == {"woolworths", "sydney", "card"}
+
+    existing = [
+        txn(date(2026, 1, 1), "WOOLWORTHS 1234 SYDNEY", 5000),
+        txn(date(2026, 1, 2), "Woolworths Sydney AU", 5000),
+        txn(date(2026, 1, 2), "Netflix", 1599, "Expenses:Subscriptions"),
+    ]
+    fuzzy = FuzzyIndex(2, 0.5, existing)
+
+    # The cleared copy, a day later and reworded, against another category
+    cleared = txn(date(2026, 1, 3), "WOOLWORTHS SYDNEY Value Date: 01/01/2026", 5000, "Expenses:Uncategorized")
+    score, match_date, narration = fuzzy.match(cleared)
+    assert (match_date, narration) == (date(2026, 1, 1), "WOOLWORTHS 1234 SYDNEY")
+    assert score == 2 / 4
+
+    # Different amount, too far away, or too different
+    assert fuzzy.match(txn(date(2026, 1, 3), "WOOLWORTHS SYDNEY", 5001)) is None
+    assert fuzzy.match(txn(date(2026, 1, 5), "WOOLWORTHS SYDNEY", 5000)) is None
+    assert fuzzy.match(txn(date(2026, 1, 2), "Coles", 5000)) is None
+
+    flagged = list(fuzzy.flag([cleared, txn(date(2026, 1, 3), "Spotify", 1599)]))
+    assert flagged[0].flag == "!"
+    assert flagged[0].meta["duplicate_of"] == "2026-01-01 WOOLWORTHS 1234 SYDNEY"
+    assert flagged[0].meta["duplicate_score"] == "0.50"
+    # Nothing in common but the amount
+    assert flagged[1] is fuzzy.pending[1] and "duplicate_of" not in flagged[1].meta
+
+    # Later files are checked against committed entries too
+    fuzzy.commit()
+    assert fuzzy.match(txn(date(2026, 1, 5), "WOOLWORTHS SYDNEY", 5000))[1] == date(2026, 1, 3)
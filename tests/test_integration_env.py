@@ -75,6 +75,13 @@ def test_full_workflow_via_env_vars(tmp_path):
         # Verify Staging is Empty
         assert staging_file.read_text() == ""
 
+        # Re-importing the same CSV is de-duplicated via the fingerprint store
+        assert (tmp_path / ".cache" / "fingerprints.sqlite").exists()
+        with patch.object(sys, "argv", ["ingest.py"]):
+            ingest.main()
+        assert "Integration Test Transaction" not in staging_file.read_text()
+        staging_file.write_text("")
+
         # 5. Run Archive
         with patch.object(sys, "argv", ["archive_files.py"]):
             archive_files.main()
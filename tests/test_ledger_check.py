@@ -0,0 +1,111 @@
+from beancount import loader
+
+from ledger_check import check
+
+MAIN = """option "title" "Test"
+option "operating_currency" "AUD"
+include "accounts.bean"
+include "ledgers/*.bean"
+"""
+
+ACCOUNTS = """2020-01-01 open Assets:Checking AUD
+2020-01-01 open Assets:Broker
+2020-01-01 open Expenses:Food
+2020-01-01 open Income:Salary
+2020-01-01 commodity VAS
+"""
+
+YEARS = {
+    2024: """2024-03-01 * "Salary"
+  Assets:Checking  1000.00 AUD
+  Income:Salary
+
+2024-06-01 * "Buy"
+  Assets:Broker  10 VAS {50.00 AUD}
+  Assets:Checking
+""",
+    2025: """2025-02-01 * "Buy more"
+  Assets:Broker  10 VAS {60.00 AUD}
+  Assets:Checking
+
+2025-12-31 * "Lunch"
+  Assets:Checking  -20.00 AUD
+  Expenses:Food
+""",
+    2026: """2026-01-01 balance Assets:Checking  -120.00 AUD
+
+2026-01-10 * "Sell the first lot"
+  Assets:Broker  -10 VAS {50.00 AUD}
+  Assets:Checking  500.00 AUD
+
+2026-01-11 balance Assets:Checking  380.00 AUD
+2026-01-11 balance Assets:Broker  10 VAS
+""",
+}
+
+
+def _ledger(tmp_path):
+    (tmp_path / "ledgers").mkdir()
+    (tmp_path / "main.bean").write_text(MAIN)
+    (tmp_path / "accounts.bean").write_text(ACCOUNTS)
+    for year, text in YEARS.items():
+        (tmp_path / "ledgers" / f"{year}.bean").write_text(text)
+    return str(tmp_path / "main.bean")
+
+
+def _messages(errors):
+    return sorted(error.message.strip() for error in errors)
+
+
+def test_check_matches_loader(tmp_path):
+    main_file = _ledger(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    assert check(main_file, cache_dir) == ([], None)
+
+    # A broken balance assertion, a missing account and an unbalanced transaction,
+    # which throws off the 2026 balances as well
+    year_file = tmp_path / "ledgers" / "2025.bean"
+    year_file.write_text(
+        YEARS[2025]
+        + '\n2025-12-31 balance Assets:Checking  1.00 AUD\n'
+        + '\n2025-12-31 * "Typo"\n  Expenses:Fod  1.00 AUD\n  Assets:Checking  -2.00 AUD\n'
+    )
+    errors, start_year = check(main_file, cache_dir)
+    assert start_year == 2025
+    _, expected, _ = loader.load_file(main_file)
+    assert len(expected) == 5
+    assert _messages(errors) == _messages(expected)
+    assert _messages(check(main_file, cache_dir, full=True)[0]) == _messages(expected)
+
+
+def test_check_starts_from_unchanged_year(tmp_path):
+    main_file = _ledger(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    assert check(main_file, cache_dir) == ([], None)
+    # Year-end balances were recorded, lots and all
+    assert check(main_file, cache_dir) == ([], 2026)
+
+    # Only the current year changed: the lot bought in 2024 is still found
+    year_file = tmp_path / "ledgers" / "2026.bean"
+    year_file.write_text(YEARS[2026] + '\n2026-02-01 balance Assets:Broker  11 VAS\n')
+    errors, start_year = check(main_file, cache_dir)
+    assert start_year == 2026
+    assert _messages(errors) == _messages(loader.load_file(main_file)[1])
+    assert len(errors) == 1
+
+    # New accounts opened this year don't invalidate earlier years
+    year_file.write_text(YEARS[2026])
+    with open(tmp_path / "accounts.bean", "a") as f:
+        f.write("2026-01-05 open Expenses:Travel\n")
+    assert check(main_file, cache_dir) == ([], 2026)
+
+    # Editing an earlier year starts from there
+    with open(tmp_path / "ledgers" / "2024.bean", "a") as f:
+        f.write('\n2024-07-01 * "Coffee"\n  Assets:Checking  -5.00 AUD\n  Expenses:Food\n')
+    errors, start_year = check(main_file, cache_dir)
+    assert start_year is None
+    assert [error.entry.date.isoformat() for error in errors] == ["2026-01-01", "2026-01-11"]
+
+    # The errors are all from 2026, so they are found again starting from there
+    assert check(main_file, cache_dir) == (errors, 2026)
+    assert check(main_file, cache_dir, full=True) == (errors, None)
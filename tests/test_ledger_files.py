@@ -0,0 +1,154 @@
+import os
+
+import pytest
+from beancount.core import data
+from beancount.parser import parser
+
+from ledger_files import merge_sorted
+
+YEAR_FILE = """; Transactions for 2026
+
+2026-01-01 * "First"
+  Assets:Checking  -1.00 AUD
+  Expenses:Food
+
+; Groceries
+2026-01-05 * "Fifth"
+  ; receipt kept
+  Assets:Checking  -5.00 AUD
+  Expenses:Food
+2026-01-05 balance Assets:Checking  -6.00 AUD
+"""
+
+
+def _staged(text):
+    entries, errors, _ = parser.parse_string(text)
+    assert not errors
+    return sorted(entries, key=data.entry_sortkey)
+
+
+def test_merge_sorted_inserts_in_date_order(tmp_path):
+    ledger = tmp_path / "2026.bean"
+    ledger.write_text(YEAR_FILE)
+    staged = _staged("""
+2026-01-05 * "Also fifth"
+  Assets:Checking  -2.00 AUD
+  Expenses:Food
+
+2026-01-03 * "Third"
+  Assets:Checking  -3.00 AUD
+  Expenses:Food
+
+2026-02-01 * "February"
+  Assets:Checking  -4.00 AUD
+  Expenses:Food
+""")
+
+    assert merge_sorted(str(ledger), staged) == 3
+
+    content = ledger.read_text()
+    assert content.startswith("; Transactions for 2026\n")
+    narrations = [line.split('"')[1] for line in content.splitlines() if '* "' in line]
+    assert narrations == ["First", "Third", "Fifth", "Also fifth", "February"]
+    # Comments stay attached to the directive after them, postings to the one above
+    assert "; Groceries\n2026-01-05 * \"Fifth\"\n  ; receipt kept\n" in content
+    assert "Expenses:Food\n\n2026-01-03 * \"Third\"" in content
+
+    entries, errors, _ = parser.parse_string(content)
+    assert not errors
+    assert len(entries) == 6
+    assert [e.date for e in entries] == sorted(e.date for e in entries)
+    assert not [f for f in os.listdir(tmp_path) if f.startswith(".merge-")]
+
+
+def test_merge_sorted_refuses_scoped_tags(tmp_path):
+    ledger = tmp_path / "2026.bean"
+    original = "pushtag #trip\n" + YEAR_FILE + "poptag #trip\n"
+    ledger.write_text(original)
+
+    with pytest.raises(ValueError, match="pushtag"):
+        merge_sorted(str(ledger), _staged('2026-01-03 * "Third"\n  Assets:Checking  -3.00 AUD\n  Expenses:Food\n'))
+
+    assert ledger.read_text() == original
+    assert os.listdir(tmp_path) == ["2026.bean"]
+
+
+def _random_transactions(count, seed=0):
+    import datetime
+    import random
+    from decimal import Decimal
+
+    from beancount.core import amount
+
+    rng = random.Random(seed)
+    accounts = ["Assets:Joint:Checking", "Expenses:Food", "Expenses:Uncategorized", "Income:Salary"]
+    numbers = ["-50.00", "1234.5", "0", "-0.001", "100", "1E+2", "99999999.99", "NaN"]
+    narrations = ["Coffee", 'Say "hi"', "back\\slash", "", "Café ☕"]
+    metas = [{}, {"category_rule": "Woolworths|Coles"}, {"note": 'quote "x"'}, {"when": datetime.date(2026, 1, 1)}]
+    entries = []
+    for i in range(count):
+        postings = []
+        for _ in range(rng.choice([1, 2, 2, 2, 3])):
+            units = rng.choice(
+                [None, amount.Amount(Decimal(rng.choice(numbers)), rng.choice(["AUD", "USD", "VANGUARD"]))]
+            )
+            price = amount.Amount(Decimal("1.5"), "USD") if rng.random() < 0.05 else None
+            flag = "!" if rng.random() < 0.05 else None
+            postings.append(data.Posting(rng.choice(accounts), units, None, price, flag, None))
+        entries.append(
+            data.Transaction(
+                dict(data.new_metadata("import.csv", i), **rng.choice(metas)),
+                datetime.date(2026, 1, 1) + datetime.timedelta(days=i % 365),
+                rng.choice(["*", "!", None]),
+                rng.choice([None, "Payee", ""]),
+                rng.choice(narrations),
+                frozenset(rng.sample(["review", "trip", "b"], rng.randint(0, 2))),
+                frozenset(rng.sample(["inv-1", "a"], rng.randint(0, 1))),
+                postings,
+            )
+        )
+    return entries
+
+
+def test_entry_writer_matches_printer():
+    import io
+
+    from beancount.parser import printer
+
+    from ledger_files import EntryWriter
+
+    entries = _random_transactions(2000)
+    expected = io.StringIO()
+    printer.print_entries(entries, file=expected)
+    out = io.StringIO()
+    writer = EntryWriter(out)
+    for entry in entries:
+        writer.write(entry)
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_format_transaction_round_trips():
+    from beancount.core import amount
+    from beancount.parser import printer
+
+    from ledger_files import format_transaction
+
+    dformat = printer.EntryPrinter().dformat
+    entries = [e for e in _random_transactions(500, seed=1) if e.flag and e.narration]
+    text = "".join(filter(None, (format_transaction(e, dformat) for e in entries)))
+    parsed, errors, _ = parser.parse_string(text)
+    assert not errors
+    fast = [e for e in entries if format_transaction(e, dformat) is not None]
+    assert len(parsed) == len(fast) > 100
+
+    def key(entry):
+        # Elided units come back as MISSING and empty payees as None
+        postings = [
+            (p.account, (p.units.number, p.units.currency) if isinstance(p.units, amount.Amount) else None)
+            for p in entry.postings
+        ]
+        meta = {k: v for k, v in entry.meta.items() if k not in ("filename", "lineno")}
+        return (entry.date, entry.flag, entry.payee or None, entry.narration, entry.tags, entry.links, postings, meta)
+
+    # The parser returns entries in date order
+    assert [key(e) for e in parsed] == [key(e) for e in sorted(fast, key=lambda e: e.date)]
@@ -0,0 +1,119 @@
+import pytest
+from beancount import loader
+from beancount.core import realization
+
+from ledger_snapshot import refresh_snapshot
+
+MAIN = """option "title" "Test"
+option "operating_currency" "AUD"
+include "accounts.bean"
+include "ledgers/*.bean"
+"""
+
+ACCOUNTS = """2020-01-01 open Assets:Checking AUD
+2020-01-01 open Assets:Broker
+2020-01-01 open Expenses:Food
+2020-01-01 open Income:Salary
+"""
+
+YEARS = {
+    2024: """2024-03-01 * "Salary"
+  Assets:Checking  1000.00 AUD
+  Income:Salary
+
+2024-06-01 * "Buy"
+  Assets:Broker  10 VAS {50.00 AUD}
+  Assets:Checking
+""",
+    2025: """2025-02-01 * "Buy more"
+  Assets:Broker  10 VAS {60.00 AUD}
+  Assets:Checking
+
+2025-12-31 * "Lunch"
+  Assets:Checking  -20.00 AUD
+  Expenses:Food
+""",
+    2026: """2026-01-10 * "Sell the first lot"
+  Assets:Broker  -10 VAS {50.00 AUD}
+  Assets:Checking  500.00 AUD
+
+2026-01-11 * "Salary"
+  Assets:Checking  1000.00 AUD
+  Income:Salary
+""",
+}
+
+
+def _ledger(tmp_path):
+    (tmp_path / "ledgers").mkdir()
+    (tmp_path / "main.bean").write_text(MAIN)
+    (tmp_path / "accounts.bean").write_text(ACCOUNTS)
+    for year, text in YEARS.items():
+        (tmp_path / "ledgers" / f"{year}.bean").write_text(text)
+    return str(tmp_path / "main.bean"), str(tmp_path / "recent.bean"), str(tmp_path / "snapshot.bean")
+
+
+def _balances(ledger_file):
+    entries, errors, _ = loader.load_file(ledger_file)
+    assert not errors
+    real_root = realization.realize(entries)
+    return {
+        real_account.account: real_account.balance
+        for real_account in realization.iter_children(real_root)
+        if not real_account.balance.is_empty()
+    }
+
+
+def test_recent_ledger_has_the_same_balance_sheet(tmp_path):
+    main_file, recent_file, snapshot_file = _ledger(tmp_path)
+    assert refresh_snapshot(main_file, recent_file, snapshot_file, years=1)
+
+    with open(recent_file) as f:
+        recent = f.read()
+    assert 'option "title" "Test"' in recent
+    assert 'include "ledgers/2026.bean"' in recent and "2025.bean" not in recent
+    with open(snapshot_file) as f:
+        snapshot = f.read()
+    assert "2026-01-01 balance Assets:Broker" in snapshot
+    assert "10 VAS {60.00 AUD, 2025-02-01}" in snapshot
+
+    full = _balances(main_file)
+    summarized = _balances(recent_file)
+    for account in ("Assets:Checking", "Assets:Broker"):
+        assert summarized[account] == full[account]
+    # Earlier income and expenses are folded into equity
+    assert str(summarized["Income:Salary"]) == "(-1000.00 AUD)"
+    assert "Equity:Earnings:Previous" in summarized
+
+
+def test_snapshot_is_regenerated_when_older_years_change(tmp_path):
+    main_file, recent_file, snapshot_file = _ledger(tmp_path)
+    assert refresh_snapshot(main_file, recent_file, snapshot_file, years=1)
+    # The number of years is remembered
+    assert not refresh_snapshot(main_file, recent_file, snapshot_file)
+
+    # The recent years are read as they are, no need to regenerate
+    with open(tmp_path / "ledgers" / "2026.bean", "a") as f:
+        f.write('\n2026-02-01 * "Lunch"\n  Assets:Checking  -10.00 AUD\n  Expenses:Food\n')
+    assert not refresh_snapshot(main_file, recent_file, snapshot_file)
+
+    with open(tmp_path / "ledgers" / "2024.bean", "a") as f:
+        f.write('\n2024-07-01 * "Coffee"\n  Assets:Checking  -5.00 AUD\n  Expenses:Food\n')
+    assert refresh_snapshot(main_file, recent_file, snapshot_file)
+    assert _balances(recent_file)["Assets:Checking"] == _balances(main_file)["Assets:Checking"]
+
+    # A different window is a different snapshot
+    assert refresh_snapshot(main_file, recent_file, snapshot_file, years=2)
+    with open(recent_file) as f:
+        assert 'include "ledgers/2025.bean"' in f.read()
+
+
+def test_snapshot_refuses_entries_that_would_count_twice(tmp_path):
+    main_file, recent_file, snapshot_file = _ledger(tmp_path)
+    with open(main_file, "a") as f:
+        f.write('2024-01-05 * "Gift"\n  Assets:Checking  5.00 AUD\n  Income:Salary\n')
+    with pytest.raises(ValueError, match="would count twice"):
+        refresh_snapshot(main_file, recent_file, snapshot_file, years=1)
+
+    with pytest.raises(ValueError, match="would include"):
+        refresh_snapshot(main_file, recent_file, str(tmp_path / "ledgers" / "snapshot.bean"), years=1)
@@ -4,8 +4,10 @@ from unittest.mock import patch
 
 import pytest
 
+from file_watcher import FileWatcher
+
 # Import the scripts to test their main execution
-from scripts import archive_files, ingest, merge_ledger
+from scripts import archive_files, ingest, merge_ledger, review
 
 
 def test_merge_ledger(tmp_path):
@@ -95,3 +97,772 @@ def test_ingest_output(tmp_path):
     content = output_file.read_text()
     assert "Test Deposit" in content
     assert "Assets:Joint:Checking" in content
+
+
+def test_ingest_failure_keeps_staging_file(tmp_path):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    (imports_dir / "checking.csv").write_text("01/01/2026,100.00,Test Deposit,1000.00\n")
+    output_file = tmp_path / "output.bean"
+    output_file.write_text("; staged earlier\n")
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+
+    argv = ["ingest.py", str(imports_dir), "--output", str(output_file), "--ledger", str(ledger_file), "--no-cache"]
+    with (
+        patch.object(sys, "argv", argv),
+        patch("ledger_files.sorted_entries", side_effect=KeyboardInterrupt),
+        pytest.raises(KeyboardInterrupt),
+    ):
+        ingest.main()
+
+    assert output_file.read_text() == "; staged earlier\n"
+    assert sorted(os.listdir(tmp_path)) == ["imports", "main.bean", "output.bean"]
+
+
+def test_merge_ledger_fingerprints(tmp_path):
+    from beancount.parser import parser
+
+    from fingerprints import FingerprintStore
+
+    staging_file = tmp_path / "staging.bean"
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    staging_content = """
+2026-01-01 * "Test Transaction"
+  Assets:Checking  -10.00 USD
+  Expenses:Food     10.00 USD
+"""
+    staging_file.write_text(staging_content)
+    staged, _, _ = parser.parse_string(staging_content)
+
+    with patch.object(
+        sys, "argv", ["merge_ledger.py", str(staging_file), str(ledgers_dir)]
+    ):
+        merge_ledger.main()
+
+    store_file = tmp_path / ".cache" / "fingerprints.sqlite"
+    with FingerprintStore(str(store_file)) as store:
+        assert not store.is_stale()
+        assert store.is_duplicate(staged[0])
+        assert not store.is_duplicate(staged[0]._replace(narration="Other"))
+
+    # Hand edits make the store stale until it is rebuilt
+    year_file = ledgers_dir / "2026.bean"
+    year_file.write_text(
+        year_file.read_text().replace("Test Transaction", "Edited Transaction")
+    )
+    with FingerprintStore(str(store_file)) as store:
+        assert store.is_stale()
+
+    with patch.object(
+        sys, "argv", ["merge_ledger.py", "--rebuild-fingerprints", str(staging_file), str(ledgers_dir)]
+    ):
+        merge_ledger.main()
+
+    with FingerprintStore(str(store_file)) as store:
+        assert not store.is_stale()
+        assert not store.is_duplicate(staged[0])
+        assert store.is_duplicate(staged[0]._replace(narration="Edited Transaction"))
+
+
+def test_ingest_parallel_matches_serial(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+
+    for i in range(4):
+        (imports_dir / f"{i}_checking.csv").write_text(
+            f"0{i + 1}/01/2026,-{i}.00,Purchase {i},100.00\n0{i + 1}/02/2026,5.00,Refund {i},105.00\n"
+        )
+    # Fails part-way through extraction
+    (imports_dir / "bad_checking.csv").write_text(
+        "01/01/2026,-1.00,Fine,99.00\nnot a date,-1.00,Broken,98.00\n"
+    )
+    (imports_dir / "notes.txt").write_text("not a statement")
+
+    outputs = {}
+    for jobs in ("1", "3"):
+        output_file = tmp_path / f"output_{jobs}.bean"
+        argv = [
+            "ingest.py",
+            str(imports_dir),
+            "--output",
+            str(output_file),
+            "--ledger",
+            str(ledger_file),
+            "--no-fingerprints",
+            "--no-cache",
+            "--jobs",
+            jobs,
+        ]
+        with patch.object(sys, "argv", argv):
+            ingest.main()
+        outputs[jobs] = (output_file.read_text(), capsys.readouterr().err.replace(str(output_file), ""))
+
+    assert outputs["1"] == outputs["3"]
+    content, log = outputs["1"]
+    assert "Purchase 3" in content
+    assert "Fine" not in content
+    assert "Error processing" in log and "bad_checking.csv" in log
+    assert "no importer matched" in log
+
+
+@pytest.mark.parametrize("jobs", ["0", "-2"])
+def test_ingest_rejects_fewer_than_one_job(tmp_path, capsys, jobs):
+    with (
+        patch.object(sys, "argv", ["ingest.py", str(tmp_path), "--jobs", jobs]),
+        pytest.raises(SystemExit) as exit_info,
+    ):
+        ingest.main()
+    assert exit_info.value.code == 2
+    assert "must be at least 1" in capsys.readouterr().err
+
+
+def test_ingest_cache_reuses_unchanged_files(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    output_file = tmp_path / "staging" / "import.bean"
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+    rules_file = tmp_path / "rules.yaml"
+    rules_file.write_text("rules: []\n")
+
+    csv_file = imports_dir / "checking.csv"
+    csv_file.write_text("01/01/2026,100.00,Test Deposit,1000.00\n")
+    (imports_dir / "old_checking.csv").write_text("02/01/2026,-5.00,Coffee,995.00\n")
+
+    argv = ["ingest.py", str(imports_dir), "--output", str(output_file), "--ledger", str(ledger_file)]
+
+    def run():
+        with patch.dict(os.environ, {"BEANCOUNT_RULES_FILE": str(rules_file)}):
+            with patch.object(sys, "argv", argv):
+                ingest.main()
+        return output_file.read_text(), capsys.readouterr().err
+
+    first, log = run()
+    assert "Test Deposit" in first and "reusing cached" not in log
+
+    second, log = run()
+    assert second == first
+    assert log.count("reusing cached entries") == 2
+
+    # A changed file is extracted again, the other one is still reused
+    csv_file.write_text("01/01/2026,100.00,Changed Deposit,1000.00\n")
+    third, log = run()
+    assert "Changed Deposit" in third
+    assert log.count("reusing cached entries") == 1
+
+    # Files that left imports/ are dropped from the cache
+    (imports_dir / "old_checking.csv").unlink()
+    run()
+    cache_dir = output_file.parent / ".ingest-cache"
+    assert len(list(cache_dir.glob("*.pickle"))) == 1
+
+    # Changing the rules invalidates everything
+    rules_file.write_text("rules:\n  - pattern: Deposit\n    account: Income:Salary\n")
+    _, log = run()
+    assert "reusing cached" not in log
+
+
+def test_ingest_loads_only_overlapping_years(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    output_file = tmp_path / "output.bean"
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"\ninclude "ledgers/*.bean"\n')
+
+    already_imported = """
+2026-01-01 * "Test Deposit"
+  Assets:Joint:Checking  100.00 AUD
+  Expenses:Uncategorized  -100.00 AUD
+"""
+    (ledgers_dir / "2020.bean").write_text(already_imported.replace("2026", "2020"))
+    (ledgers_dir / "2025.bean").write_text("; Transactions for 2025\n")
+    (ledgers_dir / "2026.bean").write_text(already_imported)
+
+    (imports_dir / "checking.csv").write_text(
+        "01/01/2026,100.00,Test Deposit,1000.00\n02/01/2026,-5.00,Coffee,995.00\n"
+    )
+
+    argv = [
+        "ingest.py",
+        str(imports_dir),
+        "--output",
+        str(output_file),
+        "--ledger",
+        str(ledger_file),
+        "--no-fingerprints",
+        "--no-cache",
+    ]
+    reads = []
+
+    def counting_open(path, *args, **kwargs):
+        reads.append(path)
+        return open(path, *args, **kwargs)
+
+    with patch.object(sys, "argv", argv), patch("importers.dispatch.open", counting_open, create=True):
+        ingest.main()
+
+    log = capsys.readouterr().err
+    assert "(2025.bean, 2026.bean)" in log
+    # The years come from the extracted entries, not another pass over the file
+    assert reads == [str(imports_dir / "checking.csv")]
+    content = output_file.read_text()
+    assert "Coffee" in content
+    assert "Test Deposit" not in content
+
+
+def test_merge_ledger_fast_matches_loader(tmp_path):
+    from fingerprints import FingerprintStore
+
+    # Elided amounts, balances and accounts the staging file never opens
+    staging_content = """
+2026-01-02 * "Second"
+  Assets:Checking  -5.00 USD
+  Expenses:Food
+
+2025-12-31 * "Last year"
+  Assets:Checking  -10.00 USD
+  Expenses:Food     10.00 USD
+
+2026-01-03 balance Assets:Checking  -15.00 USD
+"""
+    years = {}
+    for mode in ([], ["--fast"]):
+        staging_file = tmp_path / f"staging{len(mode)}.bean"
+        # Separate directories, for separate fingerprint stores
+        ledgers_dir = tmp_path / f"merge{len(mode)}" / "ledgers"
+        ledgers_dir.mkdir(parents=True)
+        staging_file.write_text(staging_content)
+        with patch.object(
+            sys, "argv", ["merge_ledger.py", *mode, str(staging_file), str(ledgers_dir)]
+        ):
+            merge_ledger.main()
+        assert staging_file.read_text() == ""
+        years[bool(mode)] = {p.name: p.read_text() for p in ledgers_dir.glob("*.bean")}
+
+    assert set(years[True]) == {"2025.bean", "2026.bean"}
+    assert years[True]["2025.bean"] == years[False]["2025.bean"]
+    # The parser leaves elided amounts as written instead of interpolating them
+    assert years[True]["2026.bean"] == years[False]["2026.bean"].replace(
+        "Expenses:Food     5.00 USD", "Expenses:Food"
+    )
+
+    # Interpolated postings are fingerprinted as in a rebuild
+    with FingerprintStore(str(tmp_path / "merge1" / ".cache" / "fingerprints.sqlite")) as store:
+        fresh = FingerprintStore(str(tmp_path / "rebuilt.sqlite"))
+        fresh.rebuild(str(tmp_path / "merge1" / "ledgers"))
+        assert sorted(store.conn.execute("SELECT digest FROM fingerprints")) == sorted(
+            fresh.conn.execute("SELECT digest FROM fingerprints")
+        )
+        fresh.close()
+
+
+def test_merge_ledger_fast_rejects_syntax_errors(tmp_path):
+    staging_file = tmp_path / "staging.bean"
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    staging_file.write_text('2026-01-01 * "Broken"\n  Assets:Checking  -10.00\n  garbage\n')
+
+    with (
+        patch.object(sys, "argv", ["merge_ledger.py", "--fast", str(staging_file), str(ledgers_dir)]),
+        pytest.raises(SystemExit),
+    ):
+        merge_ledger.main()
+    assert staging_file.read_text() != ""
+    assert not list(ledgers_dir.glob("*.bean"))
+
+
+def test_merge_ledger_sorted_stops_at_corrupt_year_file(tmp_path, capsys):
+    staging_file = tmp_path / "staging.bean"
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    corrupt = '2026-13-01 * "Bad month"\n  Assets:Checking  -1.00 USD\n  Expenses:Food\n'
+    (ledgers_dir / "2026.bean").write_text(corrupt)
+    staging_file.write_text(
+        '2025-12-31 * "Old"\n  Assets:Checking  -5.00 USD\n  Expenses:Food\n\n'
+        '2026-01-02 * "New"\n  Assets:Checking  -10.00 USD\n  Expenses:Food\n'
+    )
+
+    with (
+        patch.object(sys, "argv", ["merge_ledger.py", "--fast", "--sorted", str(staging_file), str(ledgers_dir)]),
+        pytest.raises(SystemExit) as exit_info,
+    ):
+        merge_ledger.main()
+
+    assert exit_info.value.code == 1
+    assert "2026.bean:1: invalid date" in capsys.readouterr().err
+    assert (ledgers_dir / "2026.bean").read_text() == corrupt
+    assert "Old" in (ledgers_dir / "2025.bean").read_text()
+    # Only the entries that weren't merged are left to accept again
+    assert "Old" not in staging_file.read_text()
+    assert "New" in staging_file.read_text()
+
+
+def test_ingest_skips_rows_below_watermark(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    staging_file = tmp_path / "staging" / "import.bean"
+    main_file = tmp_path / "main.bean"
+    main_file.write_text('option "title" "Test"\ninclude "ledgers/*.bean"\n')
+    env = {
+        "BEANCOUNT_IMPORTS_DIR": str(imports_dir),
+        "BEANCOUNT_STAGING_FILE": str(staging_file),
+        "BEANCOUNT_LEDGER_DIR": str(ledgers_dir),
+        "BEANCOUNT_MAIN_FILE": str(main_file),
+    }
+    csv_file = imports_dir / "checking.csv"
+    old_rows = "01/01/2026,-10.00,Coffee,90.00\n02/01/2026,-10.00,Lunch,80.00\n"
+
+    def run(script, *extra):
+        with patch.dict(os.environ, env), patch.object(sys, "argv", [f"{script.__name__}.py", *extra]):
+            script.main()
+        return capsys.readouterr().err
+
+    csv_file.write_text(old_rows)
+    run(ingest)
+    run(merge_ledger)
+
+    # A re-download overlapping what was merged, newest-first this time
+    csv_file.write_text(
+        "03/01/2026,-10.00,Dinner,60.00\n"
+        "02/01/2026,-10.00,Snack,70.00\n"
+        "02/01/2026,-10.00,Lunch,80.00\n"
+        "01/01/2026,-10.00,Coffee,90.00\n"
+    )
+    log = run(ingest, "--no-cache")
+    assert "Skipping Assets:Joint:Checking rows up to 2026-01-02 (closing balance 80.00 AUD)" in log
+    skipped = staging_file.read_text()
+    assert "Dinner" in skipped and "Snack" in skipped
+    assert "Lunch" not in skipped and "Coffee" not in skipped
+    assert "2026-01-04 balance Assets:Joint:Checking" in skipped
+
+    assert "; Skipped 2 of 4 rows of checking.csv" in log
+    # The shared importers don't keep the watermark after the run
+    assert all(importer.watermark is None for importer in ingest.config.CONFIG)
+
+    # Reading every row gives the same result, through dedup
+    log = run(ingest, "--no-cache", "--no-watermarks")
+    assert "Skipping" not in log
+    assert staging_file.read_text() == skipped
+
+
+def test_ingest_drops_duplicates_across_files(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    output_file = tmp_path / "output.bean"
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+
+    # Two overlapping exports of the same account
+    (imports_dir / "a_checking.csv").write_text(
+        "01/01/2026,-5.00,Coffee,95.00\n01/01/2026,-5.00,Coffee,90.00\n02/01/2026,-20.00,Lunch,70.00\n"
+    )
+    (imports_dir / "b_checking.csv").write_text(
+        "02/01/2026,-20.00,Lunch,70.00\n03/01/2026,-30.00,Dinner,40.00\n"
+    )
+
+    argv = [
+        "ingest.py",
+        str(imports_dir),
+        "--output",
+        str(output_file),
+        "--ledger",
+        str(ledger_file),
+        "--no-fingerprints",
+        "--no-cache",
+    ]
+    with patch.object(sys, "argv", argv):
+        ingest.main()
+
+    content = output_file.read_text()
+    assert content.count('"Coffee"') == 2
+    assert content.count('"Lunch"') == 1
+    assert content.count('"Dinner"') == 1
+    log = capsys.readouterr().err
+    assert '; Skipping 2026-01-02 "Lunch" from b_checking.csv, already taken from a_checking.csv' in log
+
+
+def test_ingest_flags_fuzzy_duplicates(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    output_file = tmp_path / "output.bean"
+    ledger_file = tmp_path / "main.bean"
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    ledger_file.write_text('option "title" "Test"\ninclude "ledgers/*.bean"\n')
+    (ledgers_dir / "2026.bean").write_text(
+        '2026-01-02 * "WOOLWORTHS 1234 SYDNEY"\n'
+        "  Assets:Joint:Checking  -50.00 AUD\n"
+        "  Expenses:Groceries\n"
+    )
+    # The cleared export moved the date and reworded the description
+    (imports_dir / "checking.csv").write_text(
+        "03/01/2026,-50.00,Woolworths Sydney AU Card xx4321,950.00\n04/01/2026,-50.00,Coles,900.00\n"
+    )
+
+    argv = [
+        "ingest.py",
+        str(imports_dir),
+        "--output",
+        str(output_file),
+        "--ledger",
+        str(ledger_file),
+        "--no-fingerprints",
+        "--no-cache",
+    ]
+    with patch.object(sys, "argv", argv):
+        ingest.main()
+    # Off by default
+    assert "duplicate_of" not in output_file.read_text()
+
+    with patch.object(sys, "argv", [*argv, "--fuzzy-days", "3"]):
+        ingest.main()
+    content = output_file.read_text()
+    assert content.count("duplicate_of") == 1
+    assert '2026-01-03 ! "Woolworths Sydney AU Card xx4321"' in content
+    assert 'duplicate_of: "2026-01-02 WOOLWORTHS 1234 SYDNEY"' in content
+    assert 'duplicate_score: "0.50"' in content
+
+    with patch.object(sys, "argv", [*argv, "--fuzzy-days", "3", "--fuzzy-threshold", "0.6"]):
+        ingest.main()
+    assert "duplicate_of" not in output_file.read_text()
+
+
+def test_ingest_watch_appends_new_files(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    output_file = tmp_path / "output.bean"
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+    (imports_dir / "a_checking.csv").write_text("01/01/2026,-5.00,Coffee,95.00\n")
+    # Still downloading
+    (imports_dir / "b_checking.csv.crdownload").write_text("02/01/2026,-20.00,Lunch,75.00\n")
+
+    def land_downloads(seconds):
+        if not (imports_dir / "b_checking.csv").exists():
+            (imports_dir / "b_checking.csv.crdownload").rename(imports_dir / "b_checking.csv")
+            # Overlaps the first export
+            (imports_dir / "c_checking.csv").write_text(
+                "01/01/2026,-5.00,Coffee,95.00\n03/01/2026,-30.00,Dinner,65.00\n"
+            )
+            return
+        raise KeyboardInterrupt
+
+    argv = [
+        "ingest.py",
+        str(imports_dir),
+        "--output",
+        str(output_file),
+        "--ledger",
+        str(ledger_file),
+        "--no-fingerprints",
+        "--no-cache",
+        "--watch",
+        "--settle",
+        "0",
+    ]
+    with patch.object(sys, "argv", argv), patch.object(ingest.time, "sleep", land_downloads):
+        ingest.main()
+
+    content = output_file.read_text()
+    assert content.count('"Coffee"') == 1
+    assert content.count('"Lunch"') == 1
+    assert content.count('"Dinner"') == 1
+    log = capsys.readouterr().err
+    assert "Successfully wrote 2 entries" in log
+    assert "Appended 4 entries" in log
+    assert "; Stopped watching" in log
+
+
+def test_file_watcher_waits_for_files_to_settle(tmp_path):
+    csv_file = tmp_path / "checking.csv"
+    csv_file.write_text("01/01/2026,-5.00,Coffee,95.00\n")
+    modified = csv_file.stat().st_mtime
+    watcher = FileWatcher(str(tmp_path), settle=5)
+
+    assert watcher.poll(modified + 1) == []
+    assert watcher.poll(modified + 5) == [str(csv_file)]
+    assert watcher.poll(modified + 10) == []
+
+    # Downloaded again with more rows
+    csv_file.write_text("01/01/2026,-5.00,Coffee,95.00\n02/01/2026,-20.00,Lunch,75.00\n")
+    os.utime(csv_file, (modified + 20, modified + 20))
+    assert watcher.poll(modified + 21) == []
+    assert watcher.poll(modified + 25) == [str(csv_file)]
+
+
+def _archived(archive_dir):
+    return sorted(str(path.relative_to(archive_dir)) for path in archive_dir.rglob("*") if path.is_file())
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_planned_archive_matches_archive_files(tmp_path, jobs):
+    exports = {
+        "checking.csv": "03/01/2026,-5.00,Coffee,95.00\n28/12/2025,-20.00,Lunch,100.00\n",
+        "checking_feb.csv": "15/02/2026,10.00,Interest,105.00\n",
+        "notes.txt": "not a statement\n",
+    }
+    for name in ("separate", "combined"):
+        (tmp_path / name / "imports").mkdir(parents=True)
+        for filename, text in exports.items():
+            (tmp_path / name / "imports" / filename).write_text(text)
+
+    separate = tmp_path / "separate"
+    with patch.object(sys, "argv", ["archive_files.py", str(separate / "imports"), str(separate / "archive")]):
+        archive_files.main()
+
+    combined = tmp_path / "combined"
+    staging_file = combined / "staging" / "import.bean"
+    ledger_file = combined / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+    (combined / "ledgers").mkdir()
+    argv = [
+        "ingest.py",
+        str(combined / "imports"),
+        "--output",
+        str(staging_file),
+        "--ledger",
+        str(ledger_file),
+        "--no-fingerprints",
+        "--plan-archive",
+        "--archive-dir",
+        str(combined / "archive"),
+        "--jobs",
+        jobs,
+    ]
+    # The second run replays the cache
+    for _ in range(2):
+        with patch.object(sys, "argv", argv):
+            ingest.main()
+    plan_file = combined / "staging" / "archive-plan.json"
+    assert '"checking.csv"' not in plan_file.read_text()
+    assert "2025-12-28_checking.csv" in plan_file.read_text()
+
+    with patch.object(sys, "argv", ["merge_ledger.py", str(staging_file), str(combined / "ledgers"), "--archive"]):
+        merge_ledger.main()
+
+    assert _archived(combined / "archive") == _archived(separate / "archive")
+    assert _archived(combined / "archive") == ["2025/2025-12-28_checking.csv", "2026/2026-02-15_checking_feb.csv"]
+    assert sorted(os.listdir(combined / "imports")) == ["notes.txt"]
+    assert not plan_file.exists()
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_planned_archive_leaves_files_that_failed(tmp_path, capsys, jobs):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    (imports_dir / "checking.csv").write_text("01/01/2026,-5.00,Coffee,95.00\n")
+    bad_file = imports_dir / "checking_bad.csv"
+    bad_file.write_text("02/01/2026,abc,Lunch,75.00\n")
+    staging_file = tmp_path / "staging" / "import.bean"
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+    argv = [
+        "ingest.py",
+        str(imports_dir),
+        "--output",
+        str(staging_file),
+        "--ledger",
+        str(ledger_file),
+        "--no-fingerprints",
+        "--no-cache",
+        "--plan-archive",
+        "--archive-dir",
+        str(tmp_path / "archive"),
+        "--jobs",
+        jobs,
+    ]
+    with patch.object(sys, "argv", argv):
+        ingest.main()
+    assert f"Error processing {bad_file}" in capsys.readouterr().err
+    assert "checking_bad.csv" not in (tmp_path / "staging" / "archive-plan.json").read_text()
+
+    (tmp_path / "ledgers").mkdir()
+    with patch.object(sys, "argv", ["merge_ledger.py", str(staging_file), str(tmp_path / "ledgers"), "--archive"]):
+        merge_ledger.main()
+    assert _archived(tmp_path / "archive") == ["2026/2026-01-01_checking.csv"]
+    assert bad_file.exists()
+
+
+def test_planned_archive_skips_changed_files(tmp_path, capsys):
+    imports_dir = tmp_path / "imports"
+    imports_dir.mkdir()
+    csv_file = imports_dir / "checking.csv"
+    csv_file.write_text("01/01/2026,-5.00,Coffee,95.00\n")
+    staging_file = tmp_path / "staging" / "import.bean"
+    ledger_file = tmp_path / "main.bean"
+    ledger_file.write_text('option "title" "Test"')
+    argv = [
+        "ingest.py",
+        str(imports_dir),
+        "--output",
+        str(staging_file),
+        "--ledger",
+        str(ledger_file),
+        "--no-fingerprints",
+        "--plan-archive",
+        "--archive-dir",
+        str(tmp_path / "archive"),
+    ]
+    with patch.object(sys, "argv", argv):
+        ingest.main()
+
+    # A newer export saved over the imported one
+    csv_file.write_text("01/01/2026,-5.00,Coffee,95.00\n02/01/2026,-20.00,Lunch,75.00\n")
+    (tmp_path / "ledgers").mkdir()
+    with patch.object(sys, "argv", ["merge_ledger.py", str(staging_file), str(tmp_path / "ledgers"), "--archive"]):
+        merge_ledger.main()
+
+    assert csv_file.exists()
+    assert not (tmp_path / "archive").exists()
+    assert "checking.csv changed since it was imported" in capsys.readouterr().err
+
+
+def test_merge_ledger_check(tmp_path, capsys):
+    staging_file = tmp_path / "staging.bean"
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    main_file = tmp_path / "main.bean"
+    main_file.write_text(
+        'include "ledgers/*.bean"\n2025-01-01 open Assets:Checking\n2025-01-01 open Expenses:Food\n'
+    )
+    (ledgers_dir / "2025.bean").write_text('2025-06-01 * "Old"\n  Assets:Checking  -1.00 AUD\n  Expenses:Food\n')
+    staging_file.write_text(
+        '2026-01-02 * "New"\n  Assets:Checking  -2.00 AUD\n  Expenses:Food\n'
+        "2026-01-03 balance Assets:Checking  -2.00 AUD\n"
+    )
+
+    argv = ["merge_ledger.py", str(staging_file), str(ledgers_dir), "--fast", "--check", "--ledger", str(main_file)]
+    with patch.object(sys, "argv", argv), pytest.raises(SystemExit) as exit_info:
+        merge_ledger.main()
+    assert exit_info.value.code == 1
+    assert "Balance failed for 'Assets:Checking'" in capsys.readouterr().err
+    assert (tmp_path / ".cache" / "check").is_dir()
+
+
+def test_merge_ledger_regenerates_snapshot(tmp_path, monkeypatch, capsys):
+    from ledger_snapshot import refresh_snapshot
+
+    ledgers_dir = tmp_path / "ledgers"
+    ledgers_dir.mkdir()
+    main_file = tmp_path / "main.bean"
+    main_file.write_text(
+        'include "ledgers/*.bean"\n2024-01-01 open Assets:Checking\n2024-01-01 open Expenses:Food\n'
+    )
+    for year in (2024, 2025, 2026):
+        (ledgers_dir / f"{year}.bean").write_text(
+            f'{year}-06-01 * "Lunch"\n  Assets:Checking  -10.00 AUD\n  Expenses:Food\n'
+        )
+    recent_file, snapshot_file = tmp_path / "recent.bean", tmp_path / "snapshot.bean"
+    monkeypatch.setenv("BEANCOUNT_RECENT_FILE", str(recent_file))
+    monkeypatch.setenv("BEANCOUNT_SNAPSHOT_FILE", str(snapshot_file))
+    refresh_snapshot(str(main_file), str(recent_file), str(snapshot_file), years=2)
+    assert "2025-01-01 balance Assets:Checking" in snapshot_file.read_text()
+    assert "-10.00 AUD" in snapshot_file.read_text()
+
+    # A back-dated entry for a summarized year
+    staging_file = tmp_path / "staging.bean"
+    staging_file.write_text('2024-07-01 * "Dinner"\n  Assets:Checking  -5.00 AUD\n  Expenses:Food\n')
+    argv = ["merge_ledger.py", str(staging_file), str(ledgers_dir), "--ledger", str(main_file)]
+    with patch.object(sys, "argv", argv):
+        merge_ledger.main()
+
+    assert f"Regenerated {snapshot_file}" in capsys.readouterr().err
+    assert "-15.00 AUD" in snapshot_file.read_text()
+
+
+def test_review_ledger_opens_only_used_accounts(tmp_path):
+    accounts_file = tmp_path / "accounts.bean"
+    accounts_file.write_text(
+        'option "operating_currency" "USD"\n'
+        'plugin "beancount.plugins.auto_accounts"\n'
+        "2020-01-01 commodity AUD\n"
+        "2020-01-01 open Assets:Checking AUD\n"
+        "2020-01-01 open Assets:Savings AUD\n"
+        '  institution: "Bank"\n'
+        "2020-01-01 open Expenses:Food\n"
+        '2020-01-01 custom "fava-option" "language" "en"\n'
+        "2024-01-01 close Assets:Savings\n"
+        'include "more_accounts.bean"\n'
+    )
+    staging_file = tmp_path / "staging.bean"
+    staging_file.write_text('2026-01-02 * "Lunch"\n  Assets:Checking  -2.00 AUD\n  Expenses:Food\n')
+
+    text = review.review_ledger(str(staging_file), str(accounts_file))
+    assert "open Assets:Checking" in text
+    assert "open Expenses:Food" in text
+    assert "Assets:Savings" not in text and "institution" not in text
+    for kept in ('option "operating_currency" "USD"', "plugin", "commodity AUD", 'custom "fava-option"'):
+        assert kept in text
+    assert f'include "{tmp_path / "more_accounts.bean"}"' in text
+    assert f'include "{staging_file}"' in text
+
+    review_file = tmp_path / "review.bean"
+    assert review.write_if_changed(str(review_file), text)
+    assert not review.write_if_changed(str(review_file), text)
+
+
+def test_review_refuses_a_port_in_use(tmp_path, monkeypatch, capsys):
+    import socket
+
+    staging_file = tmp_path / "staging" / "import.bean"
+    staging_file.parent.mkdir()
+    staging_file.write_text("")
+    accounts_file = tmp_path / "accounts.bean"
+    accounts_file.write_text("")
+    monkeypatch.setenv("BEANCOUNT_STAGING_FILE", str(staging_file))
+    monkeypatch.setenv("BEANCOUNT_ACCOUNTS_FILE", str(accounts_file))
+
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        with (
+            patch.object(sys, "argv", ["review.py", "--port", str(port)]),
+            patch.object(review.subprocess, "Popen") as popen,
+            pytest.raises(SystemExit),
+        ):
+            review.main()
+    popen.assert_not_called()
+    assert f"Port {port} is already in use" in capsys.readouterr().err
+    assert not (staging_file.parent / ".fava.pid").exists()
+
+
+def test_review_starts_fava_where_it_checks(tmp_path, monkeypatch):
+    staging_file = tmp_path / "staging" / "import.bean"
+    staging_file.parent.mkdir()
+    staging_file.write_text("")
+    accounts_file = tmp_path / "accounts.bean"
+    accounts_file.write_text("")
+    monkeypatch.setenv("BEANCOUNT_STAGING_FILE", str(staging_file))
+    monkeypatch.setenv("BEANCOUNT_ACCOUNTS_FILE", str(accounts_file))
+
+    argv = ["review.py", "--host", "127.0.0.2", "--port", "5123", "--background"]
+    with (
+        patch.object(sys, "argv", argv),
+        patch.object(review, "port_open", return_value=False),
+        patch.object(review, "wait_for_fava", return_value=True) as wait,
+        patch.object(review.subprocess, "Popen") as popen,
+    ):
+        popen.return_value.pid = 4321
+        review.main()
+
+    command = popen.call_args.args[0]
+    assert command[1:5] == ["--host", "127.0.0.2", "--port", "5123"]
+    assert wait.call_args.args[1:] == ("127.0.0.2", 5123)
+    assert (staging_file.parent / ".fava.pid").read_text() == "4321 127.0.0.2 5123\n"
+
+
+def test_review_forgets_stale_fava(tmp_path):
+    pid_file = tmp_path / ".fava.pid"
+    # This process exists, but nothing listens on the port
+    pid_file.write_text(f"{os.getpid()} 127.0.0.1 1\n")
+    assert review.running_fava(str(pid_file)) is None
+    assert not pid_file.exists()